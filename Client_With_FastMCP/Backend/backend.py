@@ -1,15 +1,483 @@
 import asyncio
+import calendar
 import os
 import json
-from datetime import date
+import re
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastmcp import Client
+from fastmcp.client.messages import MessageHandler
+from fastmcp.exceptions import McpError, ToolError
+from mcp.types import CONNECTION_CLOSED, REQUEST_TIMEOUT
 from google import genai
 from google.genai import types
-from contextlib import AsyncExitStack
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+# MCP session pool: at most MCP_MAX_SESSIONS open sessions per server, idle
+# ones pinged every MCP_KEEPALIVE_SECONDS, MCP_DEADLINE_SECONDS to connect or
+# list tools and MCP_TIMEOUT_SECONDS for a tool call.
+MCP_MAX_SESSIONS = int(os.getenv("MCP_MAX_SESSIONS", "4"))
+MCP_KEEPALIVE_SECONDS = float(os.getenv("MCP_KEEPALIVE_SECONDS", "30"))
+MCP_DEADLINE_SECONDS = float(os.getenv("MCP_DEADLINE_SECONDS", "5"))
+MCP_TIMEOUT_SECONDS = float(os.getenv("MCP_TIMEOUT_SECONDS", "30"))
+# After MCP_BREAKER_FAILURES consecutive connection failures or timeouts a
+# server is not contacted for MCP_BREAKER_COOLDOWN_SECONDS.
+MCP_BREAKER_FAILURES = int(os.getenv("MCP_BREAKER_FAILURES", "3"))
+MCP_BREAKER_COOLDOWN_SECONDS = float(os.getenv("MCP_BREAKER_COOLDOWN_SECONDS", "30"))
+# Tool lists are refetched after TOOL_CATALOG_TTL_SECONDS, or sooner when a
+# server announces that its tools changed.
+TOOL_CATALOG_TTL_SECONDS = float(os.getenv("TOOL_CATALOG_TTL_SECONDS", "300"))
+# Answer common date-range queries with local rules before asking Gemini.
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "on").lower() not in ("0", "off", "false", "no")
+# /interpret caches: Gemini decisions for read-only tools per message and day,
+# and results of read-only tools per tool and params, each with a TTL and a size cap.
+DECISION_CACHE_TTL_SECONDS = float(os.getenv("DECISION_CACHE_TTL_SECONDS", "3600"))
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "2048"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "60"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Tool name prefixes whose results may be cached, and those that change data
+# and so invalidate their server's cached results.
+READ_ONLY_TOOL_PREFIXES = ("list_", "summarize", "get_", "search_", "analyze_")
+MUTATING_TOOL_PREFIXES = ("add_", "update_", "delete_", "import_")
+
+
+class ServerUnavailable(Exception):
+    """Raised instead of contacting a server whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop contacting a server after repeated failures, then try again after a cool-down.
+
+    Closed: calls go through. Open: after `failures` consecutive failures, calls
+    are refused for `cooldown` seconds. Half-open: once the cool-down is over
+    calls go through again; the first success closes the breaker and the first
+    failure opens it for another cool-down.
+    """
+
+    def __init__(self, failures=MCP_BREAKER_FAILURES, cooldown=MCP_BREAKER_COOLDOWN_SECONDS):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self._failed = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "open" if self.retry_in() > 0 else "half-open"
+
+    def retry_in(self):
+        """Seconds left in the cool-down, 0 when calls are allowed."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        return self.state != "open"
+
+    def record_success(self):
+        self._failed = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failed += 1
+        if self.state == "half-open" or self._failed >= self.failures:
+            self._opened_at = time.monotonic()
+
+
+def error_code(error):
+    return getattr(getattr(error, "error", None), "code", None)
+
+
+class MCPSession:
+    def __init__(self, client):
+        self.client = client
+        self.in_flight = 0
+
+
+class MCPSessionPool:
+    """Persistent MCP sessions to one server, shared by every request.
+
+    A request leases the open session with the fewest requests in flight (one
+    MCP session carries many concurrent requests) and a new session is opened
+    only when all of them are busy and fewer than max_sessions are open. A
+    session whose connection fails is closed and replaced on the next lease; a
+    tool or protocol error leaves it open. Connecting and listing tools must
+    finish within deadline and tool calls within timeout; a request that runs
+    out of time is abandoned on its own, leaving the session to the requests
+    sharing it. Connection failures and timeouts trip the pool's circuit
+    breaker, and while it is open every lease raises ServerUnavailable without
+    touching the network. A keepalive
+    task pings idle sessions so dead connections are found between requests,
+    and reopens one session if the server was unreachable.
+    """
+
+    def __init__(self, url, max_sessions=MCP_MAX_SESSIONS, keepalive=MCP_KEEPALIVE_SECONDS, deadline=MCP_DEADLINE_SECONDS, timeout=MCP_TIMEOUT_SECONDS, message_handler=None):
+        self.url = url
+        self.message_handler = message_handler
+        self.max_sessions = max(1, max_sessions)
+        self.keepalive = keepalive
+        self.deadline = deadline
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self._sessions = []
+        self._lock = asyncio.Lock()
+        self._keepalive_task = None
+
+    async def start(self):
+        """Open the first session and start the keepalive task; an unreachable server is retried later."""
+        await self._connect()
+        self._keepalive_task = asyncio.create_task(self._keep_alive())
+
+    async def _connect(self):
+        if not self.breaker.allow():
+            return
+        try:
+            await self._acquire()
+        except Exception as e:
+            self.breaker.record_failure()
+            print(f"⚠️ Warning: Could not connect to {self.url}: {e}")
+        else:
+            self.breaker.record_success()
+
+    async def _open(self):
+        client = Client(self.url, timeout=self.timeout, init_timeout=self.deadline, message_handler=self.message_handler)
+        await client.__aenter__()
+        return MCPSession(client)
+
+    async def _acquire(self):
+        async with self._lock:
+            for session in [s for s in self._sessions if not s.client.is_connected()]:
+                await self._discard(session)
+            least_busy = min(self._sessions, key=lambda s: s.in_flight, default=None)
+            if least_busy is not None and (least_busy.in_flight == 0 or len(self._sessions) >= self.max_sessions):
+                return least_busy
+            try:
+                session = await self._open()
+            except Exception:
+                if least_busy is None:
+                    raise
+                # Share a busy session rather than fail the request.
+                return least_busy
+            self._sessions.append(session)
+            return session
+
+    async def _discard(self, session):
+        if session in self._sessions:
+            self._sessions.remove(session)
+        try:
+            await session.client.close()
+        except Exception:
+            pass
+
+    @asynccontextmanager
+    async def session(self):
+        """Lease a connected client for one or more requests; raises ServerUnavailable while the breaker is open."""
+        if not self.breaker.allow():
+            raise ServerUnavailable(f"{self.url} is unavailable, retrying in {self.breaker.retry_in():.0f}s")
+        try:
+            session = await self._acquire()
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        session.in_flight += 1
+        try:
+            yield session.client
+        except ToolError:
+            # The server answered, so the connection is healthy.
+            self.breaker.record_success()
+            raise
+        except (asyncio.TimeoutError, McpError) as e:
+            if isinstance(e, asyncio.TimeoutError) or error_code(e) == REQUEST_TIMEOUT:
+                # Only this request is abandoned; other requests on the session carry on.
+                self.breaker.record_failure()
+            elif error_code(e) == CONNECTION_CLOSED:
+                self.breaker.record_failure()
+                async with self._lock:
+                    await self._discard(session)
+            else:
+                # A protocol error sent by the server, so the connection is healthy.
+                self.breaker.record_success()
+            raise
+        except Exception:
+            # The transport itself failed; the next lease reconnects.
+            self.breaker.record_failure()
+            async with self._lock:
+                await self._discard(session)
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            session.in_flight -= 1
+
+    async def list_tools(self):
+        # Listing is read-only, so a request that hit a dropped connection is
+        # retried once; a timeout or an open breaker is not.
+        for attempt in (1, 2):
+            try:
+                async with self.session() as client:
+                    return await asyncio.wait_for(client.list_tools(), self.deadline)
+            except McpError as e:
+                if error_code(e) != CONNECTION_CLOSED or attempt == 2:
+                    raise
+            except (ToolError, ServerUnavailable, asyncio.TimeoutError):
+                raise
+            except Exception:
+                if attempt == 2:
+                    raise
+
+    async def call_tool(self, name, params):
+        # Bounded by the client's request timeout, which fails only this call.
+        async with self.session() as client:
+            return await client.call_tool(name, params)
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for session in [s for s in self._sessions if s.in_flight == 0]:
+                try:
+                    await asyncio.wait_for(session.client.ping(), self.deadline)
+                except McpError as e:
+                    # Any answer from the server, even one refusing ping, means the connection is alive.
+                    if error_code(e) not in (CONNECTION_CLOSED, REQUEST_TIMEOUT):
+                        continue
+                    failure = e
+                except Exception as e:
+                    failure = e
+                else:
+                    continue
+                self.breaker.record_failure()
+                # A request may have leased the session while the ping was out.
+                if session.in_flight == 0 or error_code(failure) == CONNECTION_CLOSED:
+                    print(f"⚠️ Warning: Dropping MCP session to {self.url}: {failure}")
+                    async with self._lock:
+                        await self._discard(session)
+            if not self._sessions:
+                await self._connect()
+
+    async def close(self):
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        async with self._lock:
+            for session in list(self._sessions):
+                await self._discard(session)
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries expire after ttl seconds.
+
+    Bounded by max_entries and, when sizeof is given, by max_bytes as measured
+    by sizeof(value); the least recently used entries are evicted first.
+    """
+
+    def __init__(self, ttl, max_entries=None, max_bytes=None, sizeof=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value, size)
+        self.bytes += size
+        while (self.max_entries is not None and len(self._entries) > self.max_entries) or (
+            self.max_bytes is not None and self.bytes > self.max_bytes
+        ):
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key):
+        self.bytes -= self._entries.pop(key)[2]
+
+    def discard_where(self, predicate):
+        for key in [key for key in self._entries if predicate(key)]:
+            self._pop(key)
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+
+def result_size(result):
+    """Rough size of a tool result in bytes: the length of its text content."""
+    return sum(len(getattr(block, "text", "") or "") for block in getattr(result, "content", []) or []) + 256
+
+
+class ResultCache:
+    """Results of read-only tool calls, keyed by server, tool and canonical params.
+
+    A mutating tool routed through the backend drops every cached result of
+    its server. Each server has a generation number, bumped on invalidation,
+    so a read that started before a write cannot store its older result after
+    the write has invalidated the cache.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL_SECONDS, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self._cache = TTLCache(ttl, max_bytes=max_bytes, sizeof=result_size)
+        self._generations = {}
+
+    @staticmethod
+    def key(server, tool_name, params):
+        return server, tool_name, json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+    def generation(self, server):
+        return self._generations.get(server, 0)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def put(self, key, result, generation):
+        if generation == self.generation(key[0]) and not getattr(result, "is_error", False):
+            self._cache.put(key, result)
+
+    def invalidate(self, server):
+        self._generations[server] = self.generation(server) + 1
+        self._cache.discard_where(lambda key: key[0] == server)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def describe_failure(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return "timed out"
+    return str(error) or type(error).__name__
+
+
+def render_tools_context(tools):
+    """Describe tools, one block each, for the Gemini system instruction."""
+    tool_context_list = []
+    for tool in tools:
+        params = tool.inputSchema.get('properties', {})
+        param_desc = []
+        for name, schema_dict in params.items():
+            param_type = schema_dict.get('type', 'string')
+            param_desc_text = schema_dict.get('description', '')
+            desc_part = f" - {param_desc_text}" if param_desc_text else ""
+            param_desc.append(f"'{name}' ({param_type}){desc_part}")
+        params_line = "; ".join(param_desc) if param_desc else "None"
+        tool_context_list.append(
+            f"- Name: {tool.name}\n  Description: {tool.description}\n  Parameters: {params_line}"
+        )
+    return "\n".join(tool_context_list)
+
+
+class ToolListListener(MessageHandler):
+    """Expire the catalog when a server notifies that its tool list changed."""
+
+    def __init__(self, catalog):
+        super().__init__()
+        self.catalog = catalog
+
+    async def on_tool_list_changed(self, notification):
+        self.catalog.invalidate()
+
+
+class ToolCatalog:
+    """Tools of every MCP server, fetched once and shared by every request.
+
+    Holds the combined tool list, a tool name -> pool routing dict (the first
+    server listing a name owns it) and the tools_context text for Gemini. The
+    catalog is refetched when it is older than ttl or a server sent a tool
+    list change notification; all servers are listed concurrently, so a
+    refresh takes as long as the slowest server within its deadline. A server
+    that cannot be listed keeps the tools it had last time, is named in
+    skipped, and the catalog is retried after retry_interval.
+    """
+
+    def __init__(self, pools, ttl=TOOL_CATALOG_TTL_SECONDS, retry_interval=5.0):
+        self.pools = pools
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.tools = []
+        self.routes = {}
+        self.tools_by_name = {}
+        self.tools_context = ""
+        self.skipped = {}
+        self._by_pool = {}
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+        # Sessions opened from now on report tool list changes to this catalog.
+        for pool in pools:
+            pool.message_handler = ToolListListener(self)
+
+    def invalidate(self):
+        self._expires = 0.0
+
+    async def current(self):
+        """The catalog, refreshed first if it has expired."""
+        if time.monotonic() >= self._expires:
+            async with self._lock:
+                # Another request may have refreshed it while this one waited.
+                if time.monotonic() >= self._expires:
+                    await self.refresh()
+        return self
+
+    async def refresh(self):
+        results = await asyncio.gather(*(pool.list_tools() for pool in self.pools), return_exceptions=True)
+        skipped = {}
+        for pool, result in zip(self.pools, results):
+            if isinstance(result, BaseException):
+                skipped[pool.url] = describe_failure(result)
+                print(f"⚠️ Warning: Failed to list tools from {pool.url}: {skipped[pool.url]}")
+            else:
+                self._by_pool[pool.url] = result
+        self.skipped = skipped
+        tools, routes = [], {}
+        for pool in self.pools:
+            for tool in self._by_pool.get(pool.url, []):
+                if tool.name not in routes:
+                    routes[tool.name] = pool
+                    tools.append(tool)
+        self.tools, self.routes = tools, routes
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.tools_context = render_tools_context(tools)
+        self._expires = time.monotonic() + (self.retry_interval if skipped else self.ttl)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Create the Gemini client and one MCP session pool per configured server for the app's lifetime."""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    app.state.genai_client = genai.Client(api_key=api_key) if api_key else None
+    urls = [url for url in (os.getenv("FASTMCP_URL"), os.getenv("FASTMCP_FOODCARD_URL")) if url]
+    app.state.mcp_pools = [MCPSessionPool(url) for url in urls]
+    app.state.tool_catalog = ToolCatalog(app.state.mcp_pools)
+    app.state.decision_cache = TTLCache(DECISION_CACHE_TTL_SECONDS, max_entries=DECISION_CACHE_MAX_ENTRIES)
+    app.state.result_cache = ResultCache()
+    await asyncio.gather(*(pool.start() for pool in app.state.mcp_pools))
+    await app.state.tool_catalog.current()
+    try:
+        yield
+    finally:
+        for pool in app.state.mcp_pools:
+            await pool.close()
+        if app.state.genai_client is not None:
+            await app.state.genai_client.aio.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow Streamlit frontend access
 app.add_middleware(
@@ -30,22 +498,137 @@ TOOL_CALL_SCHEMA = {
     "required": ["tool", "params"],
 }
 
-async def interpret_with_gemini(user_message, tools, genai_client):
-    tool_context_list = []
-    for tool in tools:
-        params = tool.inputSchema.get('properties', {})
-        param_desc = []
-        for name, schema_dict in params.items():
-            param_type = schema_dict.get('type', 'string')
-            param_desc_text = schema_dict.get('description', '')
-            desc_part = f" - {param_desc_text}" if param_desc_text else ""
-            param_desc.append(f"'{name}' ({param_type}){desc_part}")
-        params_line = "; ".join(param_desc) if param_desc else "None"
-        tool_context_list.append(
-            f"- Name: {tool.name}\n  Description: {tool.description}\n  Parameters: {params_line}"
-        )
-    tools_context = "\n".join(tool_context_list)
+# --- Fast-path intent rules ---
+# A message is answered without Gemini only when it is fully explained by one
+# date phrase, one intent and filler words; anything else (a category, an
+# amount, a card number, two dates) goes to the LLM.
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+QUARTERS = {"first": 1, "second": 2, "third": 3, "fourth": 4, "1st": 1, "2nd": 2, "3rd": 3, "4th": 4}
+
+
+def month_range(year, month, months=1):
+    """First and last day of `months` calendar months starting at year-month."""
+    last_month = month + months - 1
+    end_year, end_month = year + (last_month - 1) // 12, (last_month - 1) % 12 + 1
+    return date(year, month, 1), date(end_year, end_month, calendar.monthrange(end_year, end_month)[1])
 
+
+def shift_month(year, month, delta):
+    index = year * 12 + month - 1 + delta
+    return index // 12, index % 12 + 1
+
+
+def _quarter(today, number, year=None):
+    return month_range(int(year) if year else today.year, 3 * (number - 1) + 1, 3)
+
+
+def _this_quarter(today, back=0):
+    year, month = shift_month(today.year, today.month, -3 * back)
+    return _quarter(today, (month - 1) // 3 + 1, year)
+
+
+def _week(today, back=0):
+    monday = today - timedelta(days=today.weekday() + 7 * back)
+    return monday, monday + timedelta(days=6)
+
+
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+
+# (pattern, resolver(match, today) -> (start, end)), tried in order.
+DATE_RULES = [(re.compile(pattern), resolve) for pattern, resolve in [
+    (r"\btoday\b", lambda m, t: (t, t)),
+    (r"\byesterday\b", lambda m, t: (t - timedelta(days=1),) * 2),
+    (r"\b(?:this|current) week\b", lambda m, t: _week(t)),
+    (r"\b(?:last|previous) week\b", lambda m, t: _week(t, back=1)),
+    (r"\b(?:last|past) (\d{1,3}) days\b", lambda m, t: (t - timedelta(days=max(1, int(m[1])) - 1), t)),
+    (r"\b(?:this|current) month\b", lambda m, t: month_range(t.year, t.month)),
+    (r"\b(?:last|previous) month\b", lambda m, t: month_range(*shift_month(t.year, t.month, -1))),
+    (r"\b(?:this|current) quarter\b", lambda m, t: _this_quarter(t)),
+    (r"\b(?:last|previous) quarter\b", lambda m, t: _this_quarter(t, back=1)),
+    (r"\bq([1-4])(?: (\d{4}))?\b", lambda m, t: _quarter(t, int(m[1]), m[2])),
+    (r"\b(first|second|third|fourth|1st|2nd|3rd|4th) quarter(?: of)?(?: (\d{4}))?\b", lambda m, t: _quarter(t, QUARTERS[m[1]], m[2])),
+    (r"\b(?:this|current) year\b", lambda m, t: month_range(t.year, 1, 12)),
+    (r"\b(?:last|previous) year\b", lambda m, t: month_range(t.year - 1, 1, 12)),
+    # A month without a year is in the current year, as the Gemini prompt says.
+    (rf"\b({_MONTH_NAMES})(?: (\d{{4}}))?\b", lambda m, t: month_range(int(m[2]) if m[2] else t.year, MONTHS[m[1]])),
+    (r"\b(?:year )?(\d{4})\b", lambda m, t: month_range(int(m[1]), 1, 12)),
+]]
+
+_CARD = r"\b(?:food )?cards?(?: (?:actions?|transactions?|activity|activities))?\b"
+_SUMMARY = r"\b(?:summar(?:y|ies|ise|ize|ised|ized)|totals?|breakdown|how much)\b"
+_EXPENSES = r"\b(?:expenses?|expenditures?|spending|spend|spent|purchases?|transactions?)\b"
+
+# (tool, patterns that must all match), most specific first.
+INTENT_RULES = [(tool, [re.compile(p) for p in patterns]) for tool, patterns in [
+    ("summarize_card_actions", [_CARD, _SUMMARY]),
+    ("list_card_actions", [_CARD]),
+    ("summarize", [_SUMMARY]),
+    ("list_expenses", [_EXPENSES]),
+]]
+
+FILLER_WORDS = frozenset(
+    "a all an and any are by categories category did do during for from get give in is "
+    "list me my of on over please see show the to view was were what which i".split()
+)
+DATE_PARAMS = {"start_date", "end_date"}
+
+
+def resolve_dates(text, today):
+    """Find exactly one date phrase in `text`: returns (start, end, text without it), or None."""
+    for pattern, resolve in DATE_RULES:
+        match = pattern.search(text)
+        if match:
+            try:
+                start, end = resolve(match, today)
+            except ValueError:
+                return None
+            rest = text[:match.start()] + " " + text[match.end():]
+            if any(other.search(rest) for other, _ in DATE_RULES):
+                return None
+            return start, end, rest
+    return None
+
+
+def normalize_message(message):
+    """Lower-case words and numbers only, single-spaced."""
+    return " ".join(re.sub(r"[^a-z0-9 ]+", " ", message.lower()).split())
+
+
+def decision_key(message, today):
+    """Cache key for a Gemini decision: the message as typed, whitespace collapsed, and the day."""
+    return " ".join(message.split()), today.isoformat()
+
+
+def parse_intent(message, catalog, today):
+    """Map a common date-range query to {tool, params} without the LLM, or None when unsure."""
+    text = normalize_message(message)
+    found = resolve_dates(text, today)
+    if found is None:
+        return None
+    start, end, rest = found
+    for tool_name, patterns in INTENT_RULES:
+        if not all(p.search(rest) for p in patterns):
+            continue
+        for p in patterns:
+            rest = p.sub(" ", rest)
+        rest = re.sub(_EXPENSES, " ", rest)
+        if set(rest.split()) - FILLER_WORDS:
+            return None
+        tool = catalog.tools_by_name.get(tool_name)
+        if tool is None:
+            return None
+        schema = tool.inputSchema
+        # Only tools whose one required input is the date range are answered here.
+        if not DATE_PARAMS <= set(schema.get("properties", {})) or set(schema.get("required", [])) - DATE_PARAMS:
+            return None
+        return {"tool": tool_name, "params": {"start_date": start.isoformat(), "end_date": end.isoformat()}}
+    return None
+
+
+async def interpret_with_gemini(user_message, tools_context, genai_client):
     today = date.today()
     system_instruction = (
         f"Assume today is {today}. "
@@ -83,74 +666,81 @@ async def interpret(user_input: dict):
     if not message:
         raise HTTPException(status_code=400, detail="Missing 'message' field")
 
-    # --- Environment Variables ---
-    API_KEY = os.getenv("GOOGLE_API_KEY")
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="GOOGLE_API_KEY not set")
+    pools = app.state.mcp_pools
+    if not pools:
+        raise HTTPException(status_code=500, detail="No MCP endpoints configured")
 
-    FASTMCP_URL = os.getenv("FASTMCP_URL")
-    FASTMCP_FOODCARD_URL = os.getenv("FASTMCP_FOODCARD_URL")
+    catalog = await app.state.tool_catalog.current()
+    # Servers left out of the catalog on its last refresh, so the caller knows the result may be partial.
+    degraded = {}
+    if catalog.skipped:
+        degraded["skipped_servers"] = [{"server": url, "reason": reason} for url, reason in catalog.skipped.items()]
 
-    # --- Initialize available clients ---
-    genai_client = genai.Client(api_key=API_KEY)
-    clients = []
+    # --- Interpret: local rules first, then a cached Gemini decision, then Gemini ---
+    today = date.today()
+    llm_result = parse_intent(message, catalog, today) if INTENT_FAST_PATH else None
+    interpreted_by = "rules"
+    if llm_result is None:
+        llm_result = app.state.decision_cache.get(decision_key(message, today))
+        interpreted_by = "cache"
+    if llm_result is None:
+        genai_client = app.state.genai_client
+        if genai_client is None:
+            raise HTTPException(status_code=500, detail="GOOGLE_API_KEY not set")
+        llm_result = await interpret_with_gemini(message, catalog.tools_context, genai_client)
+        interpreted_by = "llm"
+    tool_name = llm_result.get("tool")
+    params = llm_result.get("params", {})
 
-    if FASTMCP_URL:
-        clients.append(Client(FASTMCP_URL))
-    if FASTMCP_FOODCARD_URL:
-        clients.append(Client(FASTMCP_FOODCARD_URL))
+    if not tool_name or tool_name == "None":
+        return {"tool": None, "params": {}, "result": "No matching tool found.", "interpreted_by": interpreted_by, **degraded}
 
-    if not clients:
-        raise HTTPException(status_code=500, detail="No MCP endpoints configured")
+    selected_pool = catalog.routes.get(tool_name)
+    if not selected_pool:
+        return {"tool": tool_name, "params": params, "result": "Tool not found in any client.", "interpreted_by": interpreted_by, **degraded}
+    # Only read-only decisions are reused: a replayed add/update/delete would
+    # repeat params taken from whichever wording was seen first.
+    if interpreted_by == "llm" and tool_name.startswith(READ_ONLY_TOOL_PREFIXES):
+        app.state.decision_cache.put(decision_key(message, today), {"tool": tool_name, "params": params})
 
-    # --- Gather tools from all clients ---
-    all_tools = []
-    async with AsyncExitStack() as stack:
-        for c in clients:
-            await stack.enter_async_context(c)
-            try:
-                tools = await c.list_tools()
-                all_tools.extend(tools)
-            except Exception as e:
-                # Skip this client if it fails to fetch tools
-                print(f"⚠️ Warning: Failed to list tools from {c.base_url}: {e}")
-
-        # --- Interpret with Gemini ---
-        llm_result = await interpret_with_gemini(message, all_tools, genai_client)
-        tool_name = llm_result.get("tool")
-        params = llm_result.get("params", {})
-
-        if not tool_name or tool_name == "None":
-            return {"tool": None, "params": {}, "result": "No matching tool found."}
-
-        # --- Find which client has this tool ---
-        selected_client = None
-        for c in clients:
-            try:
-                tools = await c.list_tools()
-                if any(t.name == tool_name for t in tools):
-                    selected_client = c
-                    break
-            except Exception:
-                continue
+    def response(result, cached=False):
+        return {
+            "tool": tool_name,
+            "params": params,
+            "result": result,
+            "executed_from": selected_pool.url,
+            "interpreted_by": interpreted_by,
+            "cached": cached,
+            **degraded,
+        }
 
-        if not selected_client:
-            return {"tool": tool_name, "params": params, "result": "Tool not found in any client."}
+    # --- Serve read-only tools from the result cache ---
+    results = app.state.result_cache
+    cacheable = tool_name.startswith(READ_ONLY_TOOL_PREFIXES)
+    if cacheable:
+        result_key = results.key(selected_pool.url, tool_name, params)
+        result = results.get(result_key)
+        if result is not None:
+            return response(result, cached=True)
+        generation = results.generation(selected_pool.url)
 
-        # --- Execute the selected tool ---
-        try:
-            result = await selected_client.call_tool(tool_name, params)
-            return {
-                "tool": tool_name,
-                "params": params,
-                "result": result,
-                "executed_from": getattr(selected_client, "base_url", "unknown")
-            }
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Error calling tool '{tool_name}' on {selected_client}: {e}"
-            )
+    # --- Execute the selected tool ---
+    try:
+        result = await selected_pool.call_tool(tool_name, params)
+        if cacheable:
+            results.put(result_key, result, generation)
+        return response(result)
+    except ServerUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Error calling tool '{tool_name}': {e}")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error calling tool '{tool_name}' on {selected_pool.url}: {e}"
+        )
+    finally:
+        # Even a failed write may have changed data, so drop the server's cached results either way.
+        if tool_name.startswith(MUTATING_TOOL_PREFIXES):
+            results.invalidate(selected_pool.url)
 
 
 if __name__ == "__main__":
@@ -1,70 +1,1311 @@
 from fastmcp import FastMCP
+from collections import OrderedDict
+from concurrent.futures import Future
+import asyncio
+import atexit
+import csv
+import datetime
+import hashlib
+import itertools
+import json
 import os
+import queue
+import re
 import sqlite3
+import sys
+import threading
+import time
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "expenses.db")
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp_tables import (
+    DEFAULT_TENANT,
+    MINOR_UNITS,
+    RESPONSE_FORMATS,
+    TENANT_ID_RE,
+    Column,
+    Database,
+    ShardPool,
+    Table,
+    Tenancy,
+    ToolRunner,
+    cancel_scope,
+    decode_cursor,
+    encode_cursor,
+    migrate,
+    money,
+    page_size,
+    shape_rows,
+    to_cents,
+)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expenses.db")
 CATEGORIES_PATH = os.path.join(os.path.dirname(__file__), "categories.json")
 
+# Connection tuning, overridable per deployment.
+READ_POOL_SIZE = int(os.getenv("EXPENSES_READ_POOL_SIZE", "4"))
+POOL_TIMEOUT = float(os.getenv("EXPENSES_POOL_TIMEOUT", "5"))
+HEALTH_CHECK_INTERVAL = float(os.getenv("EXPENSES_HEALTH_CHECK_INTERVAL", "30"))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("EXPENSES_WRITE_BATCH_MAX_SIZE", "64"))
+WRITE_BATCH_MAX_WAIT_MS = float(os.getenv("EXPENSES_WRITE_BATCH_MAX_WAIT_MS", "2"))
+# Single-row writes (add_expense, update_expense, delete_expense) wait for the
+# batcher on the event loop rather than on a writer thread; at most this many
+# per tool are in flight, so a burst can fill whole batches.
+WRITE_MAX_PENDING = int(os.getenv("EXPENSES_WRITE_MAX_PENDING", str(4 * WRITE_BATCH_MAX_SIZE)))
+RESULT_CACHE_SIZE = int(os.getenv("EXPENSES_RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL = float(os.getenv("EXPENSES_RESULT_CACHE_TTL", "60"))
+RESULT_CACHE_MAX_ROWS = int(os.getenv("EXPENSES_RESULT_CACHE_MAX_ROWS", "5000"))
+# "lenient" stores names categories.json lists in their canonical spelling and
+# accepts names it does not list (existing data uses some), but rejects a
+# subcategory it lists only under other categories. "strict" rejects any name
+# it does not list, "off" accepts anything.
+CATEGORY_VALIDATION = os.getenv("EXPENSES_CATEGORY_VALIDATION", "lenient")
+
+# Closed years can be moved out of the hot database into one archive file per
+# year under ARCHIVE_DIR. Archives are attached to every connection with a
+# small page cache of their own, so the main cache holds the current data.
+ARCHIVE_DIR = os.getenv("EXPENSES_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+ARCHIVE_CACHE_KIB = int(os.getenv("EXPENSES_ARCHIVE_CACHE_KIB", "2048"))
+
+# Tools run their blocking SQLite work on two bounded thread pools ("lanes"):
+# reads and writes never compete for the same workers. Each lane queues at
+# most LANE_MAX_QUEUE calls beyond its busy workers and each tool runs at most
+# TOOL_MAX_CONCURRENCY calls at once with TOOL_MAX_WAITING more waiting; past
+# either limit a call is refused immediately instead of piling up.
+READER_WORKERS = int(os.getenv("EXPENSES_READER_WORKERS", str(max(4, os.cpu_count() or 1))))
+WRITER_WORKERS = int(os.getenv("EXPENSES_WRITER_WORKERS", "8"))
+LANE_MAX_QUEUE = int(os.getenv("EXPENSES_LANE_MAX_QUEUE", "256"))
+TOOL_MAX_CONCURRENCY = int(os.getenv("EXPENSES_TOOL_MAX_CONCURRENCY", "16"))
+TOOL_MAX_WAITING = int(os.getenv("EXPENSES_TOOL_MAX_WAITING", "64"))
+
+# Tenancy: each tenant, named by the TENANT_HEADER request header, gets its own
+# database (and archive directory) under TENANT_DIR. Requests without the
+# header use the default tenant, whose database is DB_PATH. At most
+# SHARD_MAX_OPEN other shards are open at once; idle ones close after
+# SHARD_IDLE_TIMEOUT seconds.
+TENANT_HEADER = os.getenv("EXPENSES_TENANT_HEADER", "x-tenant-id").lower()
+TENANT_DIR = os.getenv("EXPENSES_TENANT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tenants"))
+SHARD_MAX_OPEN = int(os.getenv("EXPENSES_SHARD_MAX_OPEN", "32"))
+SHARD_IDLE_TIMEOUT = float(os.getenv("EXPENSES_SHARD_IDLE_TIMEOUT", "300"))
+
+# Bulk ingestion: files are only read from IMPORT_DIR, rows are inserted
+# IMPORT_CHUNK_SIZE at a time (callers may ask for up to MAX_IMPORT_CHUNK_SIZE)
+# and at most MAX_REPORTED_ERRORS row errors are kept.
+IMPORT_DIR = os.getenv("EXPENSES_IMPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "imports"))
+IMPORT_CHUNK_SIZE = int(os.getenv("EXPENSES_IMPORT_CHUNK_SIZE", "5000"))
+MAX_IMPORT_CHUNK_SIZE = int(os.getenv("EXPENSES_MAX_IMPORT_CHUNK_SIZE", str(max(50000, IMPORT_CHUNK_SIZE))))
+MAX_REPORTED_ERRORS = 100
+# Batch edits (update_expenses, delete_expenses) touch at most BATCH_MAX_ROWS rows per call.
+BATCH_MAX_ROWS = int(os.getenv("EXPENSES_BATCH_MAX_ROWS", "50000"))
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# list_expenses without paging returns at most UNPAGED_MAX_ROWS rows.
+UNPAGED_MAX_ROWS = int(os.getenv("EXPENSES_UNPAGED_MAX_ROWS", "10000"))
+
+# The expenses table as the shared tool engine sees it: what each column
+# selects as, the INSERT/UPDATE/DELETE statements, cached per partition and
+# column set, and the row selection of batch edits. Its tools stay hand-written below since rows live in yearly
+# partitions, writes go through the write batcher and categories are checked.
+EXPENSES = Table(
+    "expenses", "expense",
+    [
+        Column("date", "The date of the expense in YYYY-MM-DD format.", required=True,
+               range_store="day", range_parse=lambda value: _day_number(_parse_date(value))),
+        Column("amount", "The amount of the expense.", type=float, required=True, store="amount_cents",
+               parse=to_cents, select=f"CAST(amount_cents AS REAL) / {MINOR_UNITS}"),
+        Column("category", "The primary category of the expense.", required=True, match="exact",
+               match_values=lambda name: category_tree.spellings(name)),
+        Column("subcategory", "The subcategory of the expense.", default=""),
+        Column("note", "Additional notes about the expense.", default=""),
+    ],
+    page_size=DEFAULT_PAGE_SIZE, max_page_size=MAX_PAGE_SIZE, batch_max_rows=BATCH_MAX_ROWS,
+    unpaged_max_rows=UNPAGED_MAX_ROWS,
+)
+# Stored columns in the order inserts and updates write them.
+STORED_COLUMNS = tuple(col.store for col in EXPENSES.columns)
+# list_expenses columns. amount_cents may be requested but is not returned by default.
+EXPENSE_COLUMNS = tuple(EXPENSES.output)
+EXTRA_COLUMNS = ("amount_cents",)
+
+# analyze_expenses
+GRANULARITIES = ("day", "week", "month")
+DEFAULT_PERCENTILES = (50, 90, 99)
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
 mcp = FastMCP("ExpenseTracker")
 
-def init_db():
-    with sqlite3.connect(DB_PATH) as c:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS expenses(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                amount REAL NOT NULL,
-                category TEXT NOT NULL,
-                subcategory TEXT DEFAULT '',
-                note TEXT DEFAULT ''
-            )
+
+class WriteBatcher:
+    '''Group commit for concurrent writes.
+
+    Callers hand in an operation ``op(conn) -> result`` and get a future that
+    resolves once it is committed. A single background thread drains the queue, waiting at most
+    ``max_wait_ms`` after the first operation or until ``max_batch_size`` are
+    queued, and runs the whole batch in one transaction, so a burst of writes
+    costs one fsync instead of one per row. Every operation runs inside its own
+    savepoint: a failing operation is rolled back and reported to its caller
+    without affecting the rest of the batch.
+    '''
+
+    # Upper bounds of the batch-size histogram buckets.
+    BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+    def __init__(self, database, max_batch_size=WRITE_BATCH_MAX_SIZE, max_wait_ms=WRITE_BATCH_MAX_WAIT_MS):
+        self.db = database
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._operations = 0
+        self._failed = 0
+        self._largest = 0
+        self._histogram = [0] * (len(self.BUCKETS) + 1)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="expenses-write-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, op):
+        '''Queue a write; returns a Future for ``op``'s result, set when the batch holding it commits.'''
+        if self._stopped:
+            raise RuntimeError("write batcher is closed")
+        future = Future()
+        self._queue.put((op, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        # Operations whose caller gave up before they ran are dropped; the rest can no longer be cancelled.
+        batch = [(op, future) for op, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        if len(batch) == 1:
+            # Nothing to isolate from: the transaction itself rolls a failure back.
+            (op, future), = batch
+            try:
+                with self.db.transaction() as c:
+                    outcomes.append((future, op(c), None))
+            except Exception as e:
+                outcomes = [(future, None, e)]
+            self._finish(outcomes)
+            return
+        try:
+            with self.db.transaction() as c:
+                for op, future in batch:
+                    c.execute("SAVEPOINT batch_op")
+                    try:
+                        outcomes.append((future, op(c), None))
+                    except Exception as e:
+                        c.execute("ROLLBACK TO batch_op")
+                        outcomes.append((future, None, e))
+                    c.execute("RELEASE batch_op")
+        except Exception as e:
+            outcomes = [(future, None, e) for _, future in batch]
+        self._finish(outcomes)
+
+    def _finish(self, outcomes):
+        self._record(len(outcomes), sum(1 for _, _, e in outcomes if e is not None))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _record(self, size, failed):
+        bucket = next((i for i, bound in enumerate(self.BUCKETS) if size <= bound), len(self.BUCKETS))
+        with self._stats_lock:
+            self._batches += 1
+            self._operations += size
+            self._failed += failed
+            self._largest = max(self._largest, size)
+            self._histogram[bucket] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            labels = [f"<={bound}" for bound in self.BUCKETS] + [f">{self.BUCKETS[-1]}"]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "operations": self._operations,
+                "failed_operations": self._failed,
+                "mean_batch_size": round(self._operations / self._batches, 2) if self._batches else 0,
+                "largest_batch": self._largest,
+                "batch_size_histogram": dict(zip(labels, self._histogram)),
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self):
+        '''Flush whatever is queued and stop the background thread.'''
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _row_count(value):
+    if isinstance(value, list):
+        return len(value)
+    if isinstance(value, dict):
+        if "count" in value:
+            return value["count"]
+        if "items" in value:
+            return _row_count(value["items"])
+    return 0
+
+
+class ResultCache:
+    '''In-process LRU of read-tool results, invalidated by writes.
+
+    Entries are keyed on tool name plus normalized arguments and remember the
+    date range they cover. A write drops only the entries whose range contains
+    a touched date, and bumps ``generation`` so that a result computed before
+    the write committed is never stored afterwards. Entries also expire after
+    ``ttl`` seconds; results over ``max_rows`` rows are not cached.
+    '''
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, max_rows=RESULT_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidated = 0
+        self._evicted = 0
+
+    @staticmethod
+    def key(tool, *args):
+        return tool + json.dumps(args, sort_keys=True, default=str)
+
+    def fetch(self, key, low, high, compute):
+        '''Return the cached result for ``key`` or compute, store and return it.'''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[3]
+            self._misses += 1
+            generation = self.generation
+
+        value = compute()
+
+        if isinstance(value, dict) and value.get("status") == "error":
+            return value
+        if self.max_entries <= 0 or _row_count(value) > self.max_rows:
+            return value
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = (now + self.ttl, str(low).strip(), str(high).strip(), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._evicted += 1
+        return value
+
+    def invalidate(self, *dates):
+        '''Drop entries whose range covers any of ``dates``; with no dates drop everything.'''
+        dates = [str(d).strip() for d in dates if d is not None]
+        self._drop([(d, d) for d in dates] if dates else None)
+
+    def invalidate_range(self, low, high):
+        '''Drop entries whose range overlaps ``low``..``high``.'''
+        self._drop([(str(low).strip(), str(high).strip())])
+
+    def _drop(self, ranges):
+        with self._lock:
+            self.generation += 1
+            if ranges is None:
+                stale = list(self._entries)
+            else:
+                # Compare on the day prefix as well, since rollups bucket by day.
+                stale = [
+                    key for key, (_, start, end, _) in self._entries.items()
+                    if any(start <= high and low[:10] <= end for low, high in ranges)
+                ]
+            for key in stale:
+                del self._entries[key]
+            self._invalidated += len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0,
+                "invalidated": self._invalidated,
+                "evicted": self._evicted,
+                "generation": self.generation,
+            }
+
+
+class CategoryTree:
+    '''categories.json held in memory and revalidated with a single os.stat per access.
+
+    The file is reread only when its mtime, size or inode changes, so it can still
+    be edited without restarting the server. If an edit leaves invalid JSON the
+    last good version keeps being served. ``etag`` is a content hash clients can
+    compare to skip refetching.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self.text = None
+        self.etag = None
+        self.modified = None
+        self._lookup = {}
+        self._subcategories = set()
+
+    @staticmethod
+    def _normalize(name):
+        return str(name or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+    def refresh(self):
+        st = os.stat(self.path)
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if signature == self._signature:
+            return self
+        with self._lock:
+            if signature == self._signature:
+                return self
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+            try:
+                tree = json.loads(text)
+            except json.JSONDecodeError:
+                if self.text is None:
+                    raise
+                return self
+            self._lookup = {
+                self._normalize(category): (category, {self._normalize(sub): sub for sub in subs})
+                for category, subs in tree.items()
+            }
+            self._subcategories = {sub for _, subs in self._lookup.values() for sub in subs}
+            self.text = text
+            self.etag = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+            self.modified = datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc).isoformat(timespec="seconds")
+            self._signature = signature
+        return self
+
+    def resolve(self, category, subcategory=""):
+        '''Map category and subcategory to their canonical spelling; raises ValueError if not allowed.'''
+        if CATEGORY_VALIDATION == "off":
+            return category, subcategory
+        lenient = CATEGORY_VALIDATION == "lenient"
+        self.refresh()
+        entry = self._lookup.get(self._normalize(category))
+        if entry is None:
+            if lenient:
+                return category, subcategory
+            raise ValueError(f"Unknown category {category!r}; expected one of: {', '.join(sorted(c for c, _ in self._lookup.values()))}")
+        canonical, subcategories = entry
+        if not subcategory:
+            return canonical, subcategory
+        sub = subcategories.get(self._normalize(subcategory))
+        if sub is None:
+            if lenient and self._normalize(subcategory) not in self._subcategories:
+                return canonical, subcategory
+            raise ValueError(f"Unknown subcategory {subcategory!r} for {canonical}; expected one of: {', '.join(subcategories.values())}")
+        return canonical, sub
+
+    def spellings(self, category):
+        '''Stored spellings a ``category`` filter matches: as given, canonical and title-cased.
+
+        Rows written before validation keep the spelling they were added with,
+        so the argument itself and the "Dining Out" style older rows use still
+        match them.
+        '''
+        try:
+            canonical = self.resolve(category)[0]
+        except ValueError:
+            canonical = category
+        return list(dict.fromkeys([category, canonical, canonical.replace("_", " ").title()]))
+
+
+class Shard:
+    '''One tenant's storage: its database, write batcher and result cache.'''
+
+    def __init__(self, tenant, path, archive_dir):
+        self.tenant = tenant
+        self.archive_dir = archive_dir
+        self.db = Database(
+            path, read_pool_size=READ_POOL_SIZE, timeout=POOL_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL,
+            attachments=_archive_attachments(archive_dir), attachments_version=_partitions_version,
+            attached_cache_kib=ARCHIVE_CACHE_KIB,
+        )
+        try:
+            migrate(self.db, MIGRATIONS)
+        except BaseException:
+            self.db.close()
+            raise
+        self.writes = WriteBatcher(self.db)
+        self.results = ResultCache()
+
+    def close(self):
+        self.writes.close()
+        self.db.close()
+
+
+category_tree = CategoryTree(CATEGORIES_PATH)
+
+def _category_sql(category, params):
+    '''SQL condition matching ``category`` in any of its spellings; appends its parameters to ``params``.'''
+    return EXPENSES.fields["category"].condition(category, params)
+
+def _archive_attachments(archive_dir):
+    '''Attachment callback for a database whose archives live in ``archive_dir``.'''
+    def attachments(conn):
+        try:
+            rows = conn.execute("SELECT year, file FROM main.expense_partitions").fetchall()
+        except sqlite3.OperationalError:
+            # Not migrated yet.
+            return {}
+        return {f"y{year}": os.path.join(archive_dir, file) for year, file in rows}
+    return attachments
+
+def _partitions_version(conn):
+    '''Version of the partition catalog; archive_year bumps it whenever it changes the catalog.'''
+    return conn.execute("PRAGMA main.user_version").fetchone()[0]
+
+def _parse_date(value):
+    '''Parse a YYYY-MM-DD string into a date; raises ValueError.'''
+    text = str(value or "").strip()
+    if len(text) == 10:
+        try:
+            return datetime.date.fromisoformat(text)
+        except ValueError:
+            pass
+    raise ValueError(f"invalid date {text!r}, expected YYYY-MM-DD")
+
+def _day_number(date):
+    '''Days since 1970-01-01, the value stored in expenses.day.'''
+    return date.toordinal() - EPOCH_ORDINAL
+
+def _legacy_date(value):
+    '''Read a date stored before validation: YYYY-MM-DD, DD/MM/YYYY or DD-MM-YYYY; None if unreadable.'''
+    text = str(value or "").strip()
+    for pattern in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y"):
+        try:
+            return datetime.datetime.strptime(text[:10] if pattern == "%Y-%m-%d" else text, pattern).date()
+        except ValueError:
+            continue
+    return None
+
+# Expenses are stored with the amount in integer minor units (amount_cents)
+# and the date as checked YYYY-MM-DD text plus a stored day number (days since
+# 1970-01-01) derived from it, so sums are exact and range scans compare integers.
+# The CHECK rejects impossible dates such as 2023-02-30 even from ad-hoc SQL.
+EXPENSES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name}(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL CHECK (date IS date(julianday(date))),
+        day INTEGER GENERATED ALWAYS AS (CAST(julianday(date) - 2440587.5 AS INTEGER)) STORED,
+        amount_cents INTEGER NOT NULL CHECK (typeof(amount_cents) = 'integer'),
+        category TEXT NOT NULL,
+        subcategory TEXT NOT NULL DEFAULT '',
+        note TEXT NOT NULL DEFAULT ''
+    )
+"""
+
+# Rows the integer migration could not convert, kept verbatim with the reason.
+REJECTED_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS expenses_rejected(
+        id INTEGER PRIMARY KEY,
+        date, amount, category, subcategory, note,
+        reason TEXT NOT NULL
+    )
+"""
+
+# Rollups: per (bucket, category, subcategory) sum, count, min and max of
+# amount_cents, at day (day number) and month (yyyymm) granularity. Triggers
+# keep them in step with every write path (single writes, bulk imports, ad-hoc
+# SQL), so summarize never has to re-aggregate raw rows. The third field is
+# the bucket expression over a row.
+ROLLUPS = (
+    ("expense_rollup_daily", "day", "{row}.day"),
+    ("expense_rollup_monthly", "month", "CAST(substr({row}.date, 1, 4) || substr({row}.date, 6, 2) AS INTEGER)"),
+)
+
+def _rollup_table_sql(table, key):
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}(
+            {key} INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            subcategory TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            min_cents INTEGER NOT NULL,
+            max_cents INTEGER NOT NULL,
+            PRIMARY KEY ({key}, category, subcategory)
+        ) WITHOUT ROWID
+    """
+
+def _rollup_add_sql(row="NEW"):
+    statements = []
+    for table, key, bucket in ROLLUPS:
+        statements.append(f"""
+            INSERT INTO {table}({key}, category, subcategory, total_cents, count, min_cents, max_cents)
+            VALUES ({bucket.format(row=row)}, {row}.category, {row}.subcategory,
+                    {row}.amount_cents, 1, {row}.amount_cents, {row}.amount_cents)
+            ON CONFLICT({key}, category, subcategory) DO UPDATE SET
+                total_cents = total_cents + excluded.total_cents,
+                count = count + 1,
+                min_cents = MIN(min_cents, excluded.min_cents),
+                max_cents = MAX(max_cents, excluded.max_cents);
         """)
+    return "".join(statements)
+
+def _rollup_remove_sql(row="OLD"):
+    # Only when the removed amount was the bucket's min or max does it need
+    # recomputing: days from the raw rows of that day (an index seek on
+    # day, category, amount_cents), months from that month's daily rollups.
+    match = f"category = {row}.category AND subcategory = {row}.subcategory"
+    month = ROLLUPS[1][2].format(row=row)
+    raw = f"FROM expenses WHERE day = {row}.day AND {match}"
+    month_days = (
+        f"day >= {row}.day - CAST(substr({row}.date, 9, 2) AS INTEGER) + 1 "
+        f"AND day < CAST(julianday({row}.date, 'start of month', '+1 month') - 2440587.5 AS INTEGER)"
+    )
+    daily = f"FROM expense_rollup_daily WHERE {month_days} AND {match}"
+    return f"""
+        UPDATE expense_rollup_daily SET
+            total_cents = total_cents - {row}.amount_cents,
+            count = count - 1,
+            min_cents = CASE WHEN {row}.amount_cents > min_cents THEN min_cents ELSE COALESCE((SELECT MIN(amount_cents) {raw}), 0) END,
+            max_cents = CASE WHEN {row}.amount_cents < max_cents THEN max_cents ELSE COALESCE((SELECT MAX(amount_cents) {raw}), 0) END
+        WHERE day = {row}.day AND {match};
+        DELETE FROM expense_rollup_daily WHERE day = {row}.day AND {match} AND count <= 0;
+        UPDATE expense_rollup_monthly SET
+            total_cents = total_cents - {row}.amount_cents,
+            count = count - 1,
+            min_cents = CASE WHEN {row}.amount_cents > min_cents THEN min_cents ELSE COALESCE((SELECT MIN(min_cents) {daily}), 0) END,
+            max_cents = CASE WHEN {row}.amount_cents < max_cents THEN max_cents ELSE COALESCE((SELECT MAX(max_cents) {daily}), 0) END
+        WHERE month = {month} AND {match};
+        DELETE FROM expense_rollup_monthly WHERE month = {month} AND {match} AND count <= 0;
+    """
+
+ROLLUP_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_insert AFTER INSERT ON expenses BEGIN
+        {_rollup_add_sql("NEW")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_delete AFTER DELETE ON expenses BEGIN
+        {_rollup_remove_sql("OLD")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_update
+    AFTER UPDATE OF date, amount_cents, category, subcategory ON expenses BEGIN
+        {_rollup_remove_sql("OLD")}
+        {_rollup_add_sql("NEW")}
+    END
+    """,
+]
+
+def _fresh_rollup_sql(key, bucket, schema="main"):
+    return f"""
+        SELECT {bucket.format(row="e")} AS {key}, category, subcategory,
+               SUM(amount_cents) AS total_cents, COUNT(*) AS count,
+               MIN(amount_cents) AS min_cents, MAX(amount_cents) AS max_cents
+        FROM {schema}.expenses AS e
+        GROUP BY 1, 2, 3
+    """
+
+def _rebuild_rollups(c, schema="main"):
+    '''Recompute every rollup table of one partition from its raw expenses.'''
+    for table, key, bucket in ROLLUPS:
+        c.execute(f"DELETE FROM {schema}.{table}")
+        c.execute(f"INSERT INTO {schema}.{table} {_fresh_rollup_sql(key, bucket, schema)}")
+
+def _check_rollups(c, limit=100, schema="main"):
+    '''Compare one partition's rollups with its raw expenses; returns up to ``limit`` mismatched buckets.'''
+    mismatches = []
+    for table, key, bucket in ROLLUPS:
+        cur = c.execute(f"""
+            WITH fresh AS ({_fresh_rollup_sql(key, bucket, schema)})
+            SELECT f.{key}, f.category, f.subcategory, f.total_cents, f.count, r.total_cents, r.count
+            FROM fresh f LEFT JOIN {schema}.{table} r USING ({key}, category, subcategory)
+            WHERE r.count IS NULL OR r.count != f.count OR r.total_cents != f.total_cents
+               OR r.min_cents != f.min_cents OR r.max_cents != f.max_cents
+            UNION ALL
+            SELECT r.{key}, r.category, r.subcategory, NULL, NULL, r.total_cents, r.count
+            FROM {schema}.{table} r LEFT JOIN fresh f USING ({key}, category, subcategory)
+            WHERE f.count IS NULL
+            LIMIT ?
+        """, (limit - len(mismatches),))
+        for bucket_key, cat, subcat, total, count, rollup_total, rollup_count in cur:
+            mismatches.append({
+                "partition": schema, "table": table, key: bucket_key, "category": cat, "subcategory": subcat,
+                "expected_total_cents": total, "expected_count": count,
+                "rollup_total_cents": rollup_total, "rollup_count": rollup_count,
+            })
+        if len(mismatches) >= limit:
+            break
+    return mismatches
+
+def rebuild_rollups():
+    '''Backfill the rollup tables of every partition from scratch.'''
+    with db.transaction() as c:
+        for schema in _partitions(c):
+            _rebuild_rollups(c, schema)
+    results.invalidate()
+
+def check_rollups(limit=100):
+    '''Report rollup buckets that disagree with the raw expenses, in any partition.'''
+    mismatches = []
+    with db.reader() as c:
+        for schema in _partitions(c):
+            mismatches += _check_rollups(c, limit - len(mismatches), schema)
+            if len(mismatches) >= limit:
+                break
+    return {"status": "ok" if not mismatches else "mismatch", "mismatches": mismatches}
+
+# Full-text search over note, category and subcategory. The FTS5 table is an
+# external-content index on expenses (it stores no copy of the text) kept in
+# sync by triggers; unicode61 splits dining_out into "dining" and "out".
+SEARCH_TABLE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+        note, category, subcategory,
+        content='expenses', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+"""
+
+SEARCH_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO expenses_fts(rowid, note, category, subcategory)
+        VALUES (NEW.id, NEW.note, NEW.category, NEW.subcategory);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_delete AFTER DELETE ON expenses BEGIN
+        INSERT INTO expenses_fts(expenses_fts, rowid, note, category, subcategory)
+        VALUES ('delete', OLD.id, OLD.note, OLD.category, OLD.subcategory);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_expenses_fts_update
+    AFTER UPDATE OF note, category, subcategory ON expenses BEGIN
+        INSERT INTO expenses_fts(expenses_fts, rowid, note, category, subcategory)
+        VALUES ('delete', OLD.id, OLD.note, OLD.category, OLD.subcategory);
+        INSERT INTO expenses_fts(rowid, note, category, subcategory)
+        VALUES (NEW.id, NEW.note, NEW.category, NEW.subcategory);
+    END
+    """,
+]
+
+def rebuild_search_index():
+    '''Reindex expenses_fts of every partition from its expenses table and merge its segments.'''
+    with db.transaction() as c:
+        for schema in _partitions(c):
+            c.execute(f"INSERT INTO {schema}.expenses_fts(expenses_fts) VALUES ('rebuild')")
+            c.execute(f"INSERT INTO {schema}.expenses_fts(expenses_fts) VALUES ('optimize')")
+    results.invalidate()
+
+def _convert_to_integer_storage(c):
+    '''Rebuild expenses on the integer schema, keeping every id.
+
+    Amounts become cents and dates are normalized to YYYY-MM-DD, including the
+    day-first forms older clients wrote. A row whose date or amount cannot be
+    read is moved to expenses_rejected rather than dropped. The REAL-valued
+    rollups are dropped here and rebuilt on the new columns afterwards.
+    '''
+    for trigger in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_expenses_rollup_{trigger}")
+    for table, _, _ in ROLLUPS:
+        c.execute(f"DROP TABLE IF EXISTS {table}")
+    c.execute(EXPENSES_TABLE_SQL.format(name="expenses_v6"))
+    c.execute(REJECTED_TABLE_SQL)
+
+    cur = c.execute("SELECT id, date, amount, category, subcategory, note FROM expenses ORDER BY id")
+    while rows := cur.fetchmany(IMPORT_CHUNK_SIZE):
+        kept, rejected = [], []
+        for row in rows:
+            id, date, amount, category, subcategory, note = row
+            day = _legacy_date(date)
+            try:
+                cents = to_cents(amount)
+            except ValueError as e:
+                rejected.append((*row, str(e)))
+                continue
+            if day is None:
+                rejected.append((*row, f"invalid date {date!r}"))
+                continue
+            kept.append((id, day.isoformat(), cents, category, subcategory or "", note or ""))
+        c.executemany(
+            "INSERT INTO expenses_v6(id, date, amount_cents, category, subcategory, note) VALUES (?,?,?,?,?,?)",
+            kept
+        )
+        c.executemany(
+            "INSERT OR REPLACE INTO expenses_rejected(id, date, amount, category, subcategory, note, reason) VALUES (?,?,?,?,?,?,?)",
+            rejected
+        )
+
+    # Dropping the old table forgets its AUTOINCREMENT high-water mark; keep it
+    # so ids of deleted rows are never handed out again.
+    seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'expenses'").fetchone()
+    c.execute("DROP TABLE expenses")
+    c.execute("ALTER TABLE expenses_v6 RENAME TO expenses")
+    if seq and not c.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'expenses'", seq
+    ).rowcount:
+        c.execute("INSERT INTO sqlite_sequence(name, seq) VALUES ('expenses', ?)", seq)
+
+# Year partitions. The hot database (main) may hold rows of any year; an
+# archive schema yYYYY holds only rows dated in YYYY. Reads therefore always
+# include main plus the archives overlapping the requested range, and writes
+# land in main unless they edit a row already archived.
+PARTITIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS expense_partitions(
+        year INTEGER PRIMARY KEY,
+        file TEXT NOT NULL,
+        first_day INTEGER NOT NULL,
+        last_day INTEGER NOT NULL,
+        archived_at TEXT NOT NULL
+    )
+"""
+
+MOVE_COLUMNS = "id, date, amount_cents, category, subcategory, note"
+
+def _partitions(c, start_day=None, end_day=None):
+    '''Schemas that may hold expenses between two day numbers (either bound optional), main last.'''
+    query = "SELECT year FROM main.expense_partitions WHERE 1"
+    params = []
+    if start_day is not None:
+        query += " AND last_day >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        query += " AND first_day <= ?"
+        params.append(end_day)
+    return [f"y{year}" for year, in c.execute(query + " ORDER BY year", params)] + ["main"]
+
+def _union(schemas, arm, params):
+    '''UNION ALL of the ``arm`` query (with a {schema} placeholder) over partitions, with its params repeated.'''
+    return " UNION ALL ".join(arm.format(schema=schema) for schema in schemas), list(params) * len(schemas)
+
+def _locate(c, id, columns="date"):
+    '''Find expense ``id`` in any partition; returns (schema, row) or (None, None).'''
+    for schema in reversed(_partitions(c)):
+        row = c.execute(f"SELECT {columns} FROM {schema}.expenses WHERE id = ?", (id,)).fetchone()
+        if row is not None:
+            return schema, row
+    return None, None
+
+def _move_rows(source, target, where, params=()):
+    '''Move the expenses matching ``where`` between partitions, ids intact; returns how many left ``source``.
+
+    A WAL transaction spanning attached files is not atomic across them, so
+    each step writes one file only: the rows are copied and committed to
+    ``target`` first, then deleted from ``source`` where ``target`` has them.
+    A crash in between leaves rows in both files, never in neither, and moving
+    them again finishes the job; readers may see such rows twice meanwhile.
+    Each partition's triggers keep its own rollups and search index in step.
+    '''
+    with db.transaction() as c:
+        c.execute(
+            f"INSERT OR IGNORE INTO {target}.expenses({MOVE_COLUMNS}) "
+            f"SELECT {MOVE_COLUMNS} FROM {source}.expenses WHERE {where}", params
+        )
+    with db.transaction() as c:
+        return c.execute(
+            f"DELETE FROM {source}.expenses WHERE ({where}) AND id IN (SELECT id FROM {target}.expenses)", params
+        ).rowcount
+
+def _unarchive(where, params, new_date, start_day=None, end_day=None):
+    '''Move archived expenses matching ``where`` that ``new_date`` takes out of their year back to main.
+
+    Runs ahead of the edit that redates them, so the edit itself only writes
+    main; main may hold rows of any year, so they can stay there if it fails.
+    '''
+    with db.reader() as c:
+        schemas = [
+            schema for schema in _partitions(c, start_day, end_day)[:-1]
+            if not new_date.startswith(f"{schema[1:]}-")
+            and c.execute(f"SELECT 1 FROM {schema}.expenses WHERE {where} LIMIT 1", params).fetchone()
+        ]
+    for schema in schemas:
+        _move_rows(schema, "main", where, params)
+
+# Ordered schema migrations: (version, description, steps). A step is SQL or a
+# callable taking the connection. Each migration runs once, in its own
+# transaction, and is recorded in schema_version. Steps stay idempotent so
+# databases created before versioning upgrade cleanly.
+MIGRATIONS = [
+    (1, "create expenses table", [
+        """
+        CREATE TABLE IF NOT EXISTS expenses(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            subcategory TEXT DEFAULT '',
+            note TEXT DEFAULT ''
+        )
+        """,
+    ]),
+    (2, "index expenses by date for keyset pagination", [
+        # The index stores the rowid, so (date, id) pages are a range scan.
+        "CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date)",
+    ]),
+    (3, "covering indexes for date-range and per-category queries", [
+        "CREATE INDEX IF NOT EXISTS idx_expenses_date_category_amount ON expenses(date, category, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses(category, date, amount)",
+        "ANALYZE",
+    ]),
+    # The REAL-valued rollups this created are superseded by migration 6,
+    # which drops any that exist and rebuilds them on integer columns.
+    (4, "daily and monthly rollups maintained by triggers", []),
+    (5, "full-text search index over note, category and subcategory", [
+        SEARCH_TABLE_SQL,
+        *SEARCH_TRIGGERS,
+        "INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')",
+    ]),
+    (6, "integer cents amounts and indexed day numbers", [
+        _convert_to_integer_storage,
+        # Dropping the old table took its indexes and triggers with it.
+        "CREATE INDEX IF NOT EXISTS idx_expenses_day ON expenses(day)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_day_category_amount ON expenses(day, category, amount_cents)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_category_day ON expenses(category, day, amount_cents)",
+        *(_rollup_table_sql(table, key) for table, key, _ in ROLLUPS),
+        *ROLLUP_TRIGGERS,
+        _rebuild_rollups,
+        *SEARCH_TRIGGERS,
+        "INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')",
+        "ANALYZE expenses",
+    ]),
+    (7, "catalog of archived year partitions", [
+        PARTITIONS_TABLE_SQL,
+    ]),
+    # FTS5 looks up its shadow tables by key on every insert; statistics
+    # gathered while they were small steer it into scans as the index grows.
+    (8, "drop planner statistics for the search index shadow tables", [
+        "DELETE FROM sqlite_stat1 WHERE tbl LIKE 'expenses_fts%'",
+    ]),
+]
+
+def init_db():
+    '''Open the default tenant's shard, applying any pending migrations.'''
+    return Shard(DEFAULT_TENANT, DB_PATH, ARCHIVE_DIR)
+
+def open_tenant(tenant):
+    root = os.path.join(TENANT_DIR, tenant)
+    os.makedirs(root, exist_ok=True)
+    return Shard(tenant, os.path.join(root, "expenses.db"), os.path.join(root, "archive"))
+
+shards = ShardPool(init_db(), open_tenant, SHARD_MAX_OPEN, SHARD_IDLE_TIMEOUT, name="expenses")
+atexit.register(shards.close)
+
+# The shard serving the current call. Tools and helpers reach it through the
+# db, writes and results proxies below, so the storage code reads as if there
+# were a single database; outside a request (CLI, scripts) it is the default
+# tenant's shard.
+tenancy = Tenancy(shards, TENANT_HEADER, name="expenses")
+mcp.add_middleware(tenancy.middleware())
+current_shard = tenancy.current
+use_tenant = tenancy.use
+db = tenancy.attribute("db")
+writes = tenancy.attribute("writes")
+results = tenancy.attribute("results")
+
+def archive_year(year):
+    '''Move every expense dated in ``year`` into its own archive file, then compact both files.
+
+    Rows move IMPORT_CHUNK_SIZE at a time, each chunk committed to the archive
+    before it is deleted from main, and stay readable throughout. Running it
+    again for an archived year sweeps rows written to main since, and finishes
+    a chunk an interrupted run left in both files.
+    '''
+    year = int(year)
+    if year >= datetime.date.today().year:
+        raise ValueError(f"{year} is not closed yet")
+    first_day = _day_number(datetime.date(year, 1, 1))
+    last_day = _day_number(datetime.date(year, 12, 31))
+    schema = f"y{year}"
+    file = f"expenses-{year}.db"
+
+    archive_dir = current_shard().archive_dir
+    os.makedirs(archive_dir, exist_ok=True)
+    archive = Database(os.path.join(archive_dir, file), read_pool_size=1)
+    try:
+        migrate(archive, MIGRATIONS)
+    finally:
+        archive.close()
+
+    with db.transaction() as c:
+        others = c.execute("SELECT COUNT(*) FROM expense_partitions WHERE year != ?", (year,)).fetchone()[0]
+        if others + 1 > c.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+            raise ValueError(f"SQLite can attach at most {others} archives here; {year} would exceed that")
+        c.execute(
+            """
+            INSERT INTO expense_partitions(year, file, first_day, last_day, archived_at) VALUES (?,?,?,?,?)
+            ON CONFLICT(year) DO UPDATE SET archived_at = excluded.archived_at
+            """,
+            (year, file, first_day, last_day, datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"))
+        )
+        # Tells every connection, in this process or another, to attach the archive.
+        c.execute(f"PRAGMA main.user_version = {_partitions_version(c) + 1}")
+
+    moved = 0
+    chunk = "id IN (SELECT id FROM main.expenses WHERE day BETWEEN ? AND ? ORDER BY day, id LIMIT ?)"
+    while True:
+        count = _move_rows("main", schema, chunk, (first_day, last_day, IMPORT_CHUNK_SIZE))
+        moved += count
+        if count < IMPORT_CHUNK_SIZE:
+            break
+
+    with db.transaction() as c:
+        c.execute(f"INSERT INTO {schema}.expenses_fts(expenses_fts) VALUES ('optimize')")
+        c.execute(f"ANALYZE {schema}.expenses")
+        rows = c.execute(f"SELECT COUNT(*) FROM {schema}.expenses").fetchone()[0]
+    db.vacuum(schema)
+    db.vacuum("main")
+    results.invalidate()
+    return {"status": "ok", "year": year, "file": file, "moved": moved, "rows": rows}
+
+def _validate_expense(row):
+    '''Check one incoming expense row and return it as an insert tuple; raises ValueError.'''
+    if isinstance(row, ValueError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    date = _parse_date(row.get("date")).isoformat()
+    cents = to_cents(row.get("amount"))
+    category = str(row.get("category") or "").strip()
+    if not category:
+        raise ValueError("category is required")
+    category, subcategory = category_tree.resolve(category, str(row.get("subcategory") or ""))
+    note = str(row.get("note") or "")
+    return (date, cents, category, subcategory, note)
+
+def _ingest(numbered_rows, chunk_size=IMPORT_CHUNK_SIZE):
+    '''Validate and insert ``(row_number, row)`` pairs in chunked transactions.
+
+    Only one chunk is held in memory at a time, so the input may be a lazy
+    iterator over an arbitrarily large file. Chunks are already batched, so
+    they take the writer directly instead of a savepoint in the write batcher.
+    '''
+    inserted = failed = 0
+    errors = []
+    chunk_size = min(max(1, int(chunk_size)), MAX_IMPORT_CHUNK_SIZE)
+
+    rows = iter(numbered_rows)
+    scope = cancel_scope.get()
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk or (scope is not None and scope.cancelled):
+            break
+        values = []
+        for number, row in chunk:
+            try:
+                values.append(_validate_expense(row))
+            except ValueError as e:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": number, "error": str(e)})
+        if values:
+            with db.transaction() as c:
+                c.executemany(
+                    EXPENSES.insert_sql(STORED_COLUMNS),
+                    values
+                )
+            inserted += len(values)
+            results.invalidate_range(min(v[0] for v in values), max(v[0] for v in values))
 
-init_db()
+    return {
+        "status": "ok" if not failed else "partial",
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors),
+    }
+
+def _read_import_file(path, file_format):
+    '''Stream ``(row_number, row)`` pairs from a CSV or JSONL file.'''
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if file_format == "csv":
+            for number, row in enumerate(csv.DictReader(f), start=1):
+                yield number, row
+        else:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield number, ValueError(f"invalid JSON: {e.msg}")
+
+def _projection(columns):
+    if not columns:
+        return list(EXPENSE_COLUMNS)
+    unknown = [col for col in columns if col not in EXPENSE_COLUMNS + EXTRA_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return list(dict.fromkeys(columns))
+
+def _select_list(cols):
+    '''SQL select list for projected columns; amount is derived from amount_cents.'''
+    return ", ".join(EXPENSES.fields[col].select_sql if col in EXPENSES.fields else col for col in cols)
+
+def _day_range(start_date, end_date):
+    '''Validate an inclusive YYYY-MM-DD range and return it as day numbers; raises ValueError.'''
+    return _day_number(_parse_date(start_date)), _day_number(_parse_date(end_date))
+
+def _keyset_query(schemas, start_day, end_day, cols, after=None, limit=None):
+    '''Build the (day, id)-ordered range query over partitions; the first two result columns are the key.
+
+    Every partition's arm is an index range scan in key order, which SQLite
+    merges, so a page reads at most ``limit`` rows from each.
+    '''
+    arm = f"SELECT day, id, {_select_list(cols)} FROM {{schema}}.expenses WHERE day BETWEEN ? AND ?"
+    params = [start_day, end_day]
+    if after is not None:
+        arm += " AND (day, id) > (?, ?)"
+        params.extend(after)
+    query, params = _union(schemas, arm, params)
+    query += " ORDER BY day, id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+runner = ToolRunner("expenses", READER_WORKERS, WRITER_WORKERS, LANE_MAX_QUEUE, TOOL_MAX_CONCURRENCY, TOOL_MAX_WAITING)
+atexit.register(runner.close)
+readers, writers = runner.readers, runner.writers
 
 @mcp.tool()
-def add_expense(date, amount, category, subcategory="", note=""):
+@runner.gated(limit=WRITE_MAX_PENDING)
+async def add_expense(date, amount, category, subcategory="", note=""):
     '''Add a new expense entry to the database.
 
     Args:
         date (str): The date of the expense in YYYY-MM-DD format.
         amount (float): The amount of the expense.
-        category (str): The primary category of the expense.
-        subcategory (str, optional): The subcategory of the expense. Defaults to "".
+        category (str): The primary category of the expense, as listed in expense://categories.
+        subcategory (str, optional): The subcategory of the expense, from that category's list. Defaults to "".
         note (str, optional): Additional notes about the expense. Defaults to "".
     '''
-    with sqlite3.connect(DB_PATH) as c:
+    try:
+        values = _validate_expense(
+            {"date": date, "amount": amount, "category": category, "subcategory": subcategory, "note": note}
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    def insert(c):
         cur = c.execute(
-            "INSERT INTO expenses(date, amount, category, subcategory, note) VALUES (?,?,?,?,?)",
-            (date, amount, category, subcategory, note)
+            EXPENSES.insert_sql(STORED_COLUMNS),
+            values
         )
         return {"status": "ok", "id": cur.lastrowid}
+
+    result = await asyncio.wrap_future(writes.submit(insert))
+    results.invalidate(values[0])
+    return result
+
+@mcp.tool()
+@runner.offload(writers)
+def add_expenses(rows: list[dict]):
+    '''Add many expense entries in one call.
+
+    Args:
+        rows (list): Expense objects with the same fields as add_expense
+            (date, amount, category, and optional subcategory and note).
+
+    Returns:
+        dict: Counts of inserted and failed rows, plus per-row errors (1-based row numbers).
+    '''
+    return _ingest(enumerate(rows, start=1))
+
+@mcp.tool()
+@runner.offload(writers, limit=1)
+def import_expenses(path: str, file_format: str = None, chunk_size: int = IMPORT_CHUNK_SIZE):
+    '''Import expenses from a CSV or JSONL file in the server's import directory.
+
+    The file is streamed and inserted chunk by chunk, so memory use stays flat
+    regardless of its size.
+
+    Args:
+        path (str): File path, relative to the import directory.
+        file_format (str, optional): "csv" or "jsonl". Inferred from the extension by default.
+        chunk_size (int, optional): Rows per transaction, capped by the server (50000 by default).
+
+    Returns:
+        dict: Counts of inserted and failed rows, plus per-row errors (CSV data row or JSONL line numbers).
+    '''
+    root = os.path.realpath(IMPORT_DIR)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        return {"status": "error", "message": "Path must be inside the import directory"}
+    if not os.path.isfile(full_path):
+        return {"status": "error", "message": f"File {path} not found"}
+
+    if file_format is None:
+        extension = os.path.splitext(full_path)[1].lower()
+        file_format = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(extension)
+    if file_format not in ("csv", "jsonl"):
+        return {"status": "error", "message": "file_format must be 'csv' or 'jsonl'"}
+
+    return _ingest(_read_import_file(full_path, file_format), chunk_size)
     
+def _list_expenses(start_date, end_date, limit=None, after_id=None, cursor=None, columns=None, format="records", compress=False):
+    try:
+        start_day, end_day = _day_range(start_date, end_date)
+        cols = _projection(columns)
+        after = decode_cursor(cursor, (int, int)) if cursor else None
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    if format not in RESPONSE_FORMATS:
+        return {"status": "error", "message": f"format must be one of: {', '.join(RESPONSE_FORMATS)}"}
+
+    if limit is None and after_id is None and cursor is None:
+        with db.reader() as c:
+            # id leads the select list so the partitions' arms can be ordered by it.
+            query, params = _union(
+                _partitions(c, start_day, end_day),
+                f"SELECT id AS _id, {_select_list(cols)} FROM {{schema}}.expenses WHERE day BETWEEN ? AND ?",
+                (start_day, end_day)
+            )
+            rows = c.execute(query + " ORDER BY _id ASC LIMIT ?", [*params, UNPAGED_MAX_ROWS + 1]).fetchall()
+        if len(rows) > UNPAGED_MAX_ROWS:
+            return {"status": "error", "message": f"More than {UNPAGED_MAX_ROWS} expenses match; pass limit or cursor to page through them"}
+        return shape_rows(cols, [r[1:] for r in rows], format, compress)
+
+    limit = page_size(limit, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    with db.reader() as c:
+        if after is None and after_id is not None:
+            _, row = _locate(c, after_id, "day, id")
+            if row is None:
+                return {"status": "error", "message": f"Record with id {after_id} not found"}
+            after = tuple(row)
+        query, params = _keyset_query(_partitions(c, start_day, end_day), start_day, end_day, cols, after, limit + 1)
+        rows = c.execute(query, params).fetchall()
+
+    next_cursor = encode_cursor(*rows[limit - 1][:2]) if len(rows) > limit else None
+    items = shape_rows(cols, [r[2:] for r in rows[:limit]], format, compress)
+    return {"items": items, "next_cursor": next_cursor}
+
+def _rollup_summary_query(schemas, start, end, category=None):
+    '''Build a per-category summary over the partitions' rollups for the whole days start..end.
+
+    Calendar months fully inside the range come from the monthly rollup, the
+    partial months at either edge from the daily rollup.
+    '''
+    first_full = start if start.day == 1 else (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    after_end = end + datetime.timedelta(days=1)
+    last_full = end if after_end.day == 1 else end.replace(day=1) - datetime.timedelta(days=1)
+
+    parts = []
+    params = []
+    if first_full <= last_full:
+        ranges = [
+            ("expense_rollup_monthly", "month", first_full.year * 100 + first_full.month, last_full.year * 100 + last_full.month),
+            ("expense_rollup_daily", "day", _day_number(start), _day_number(first_full) - 1),
+            ("expense_rollup_daily", "day", _day_number(last_full) + 1, _day_number(end)),
+        ]
+    else:
+        ranges = [("expense_rollup_daily", "day", _day_number(start), _day_number(end))]
+    for schema, (table, key, low, high) in itertools.product(schemas, ranges):
+        if low > high:
+            continue
+        part = f"SELECT category, total_cents FROM {schema}.{table} WHERE {key} BETWEEN ? AND ?"
+        params.extend([low, high])
+        if category:
+            part += " AND " + _category_sql(category, params)
+        parts.append(part)
+    if not parts:
+        parts.append("SELECT category, total_cents FROM expense_rollup_daily WHERE 0")
+    query = (
+        f"SELECT category, SUM(total_cents) FROM ({' UNION ALL '.join(parts)}) "
+        "GROUP BY category ORDER BY category ASC"
+    )
+    return query, params
+
 @mcp.tool()
-def list_expenses(start_date, end_date):
+@runner.offload(readers)
+def list_expenses(start_date, end_date, limit: int = None, after_id: int = None, cursor: str = None, columns: list[str] = None, format: str = "records", compress: bool = False):
     '''List expense entries within an inclusive date range.
 
+    Without limit, after_id or cursor every matching expense is returned at once,
+    ordered by id, up to 10000 (larger ranges must be paged). Passing any of them
+    switches to pages ordered by date then id.
+
     Args:
         start_date (str): The start date of the range in YYYY-MM-DD format.
         end_date (str): The end date of the range in YYYY-MM-DD format.
+        limit (int, optional): Page size (max 1000). Defaults to 100 when paging.
+        after_id (int, optional): Return the page that follows this expense id.
+        cursor (str, optional): The next_cursor value of the previous page.
+        columns (list, optional): Columns to return, from id, date, amount, category, subcategory, note,
+            plus amount_cents (the exact stored amount in minor units).
+        format (str, optional): "records" (a dict per expense), "table" ({columns, rows}) or
+            "columnar" ({columns, values} with one array per column). Defaults to "records".
+        compress (bool, optional): Return the result gzip-compressed and base64-encoded
+            as {encoding, format, count, data}. Defaults to False.
 
     Returns:
-        list: A list of dictionaries, each representing an expense.
+        list: A list of dictionaries, each representing an expense (or the table/columnar
+        object), or when paging a dict with "items" and "next_cursor" (None on the last page).
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            """
-            SELECT id, date, amount, category, subcategory, note
-            FROM expenses
-            WHERE date BETWEEN ? AND ?
-            ORDER BY id ASC
-            """,
-            (start_date, end_date)
-        )
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+    key = results.key("list_expenses", start_date, end_date, limit, after_id, cursor, columns, format, compress)
+    return results.fetch(
+        key, start_date, end_date,
+        lambda: _list_expenses(start_date, end_date, limit, after_id, cursor, columns, format, compress)
+    )
+
+def _summarize(start_date, end_date, category=None):
+    try:
+        start = _parse_date(start_date)
+        end = _parse_date(end_date)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    with db.reader() as c:
+        schemas = _partitions(c, _day_number(start), _day_number(end))
+        query, params = _rollup_summary_query(schemas, start, end, category)
+        rows = c.execute(query, params).fetchall()
+    # Summed exactly in cents, converted once at the edge.
+    return [{"category": name, "total_amount": money(total)} for name, total in rows]
 
 @mcp.tool()
+@runner.offload(readers)
 def summarize(start_date, end_date, category=None):
     '''Summarize expenses by category within an inclusive date range.
 
@@ -76,28 +1317,255 @@ def summarize(start_date, end_date, category=None):
     Returns:
         list: A list of dictionaries containing category and total_amount.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        query = (
-            """
-            SELECT category, SUM(amount) AS total_amount
-            FROM expenses
-            WHERE date BETWEEN ? AND ?
-            """
-        )
-        params = [start_date, end_date]
+    key = results.key("summarize", start_date, end_date, category or None)
+    return results.fetch(key, start_date, end_date, lambda: _summarize(start_date, end_date, category))
 
-        if category:
-            query += " AND category = ?"
-            params.append(category)
+def _load_daily_columns(start_day, end_day, category=None):
+    '''Load the daily rollups of a day-number range as columnar arrays.
+
+    Returns (days since 1970-01-01, bucket totals in integer cents, bucket row
+    counts, dictionary codes of (category, subcategory), the code -> pair list),
+    all int64. One row per day and subcategory stands in for every raw expense
+    behind it, so the arrays stay small however many rows the range holds.
+    '''
+    arm = """
+        SELECT day, total_cents, count, category, subcategory
+        FROM {schema}.expense_rollup_daily
+        WHERE day BETWEEN ? AND ?
+    """
+    params = [start_day, end_day]
+    if category:
+        arm += " AND " + _category_sql(category, params)
+    with db.reader() as c:
+        rows = c.execute(*_union(_partitions(c, start_day, end_day), arm, params)).fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty, []
+
+    day_col, total_col, count_col, cat_col, sub_col = zip(*rows)
+    dictionary = {}
+    codes = np.fromiter(
+        (dictionary.setdefault(pair, len(dictionary)) for pair in zip(cat_col, sub_col)),
+        dtype=np.int64, count=len(rows)
+    )
+    days = np.array(day_col, dtype=np.int64)
+    cents = np.array(total_col, dtype=np.int64)
+    counts = np.array(count_col, dtype=np.int64)
+    return days, cents, counts, codes, list(dictionary)
+
+def _load_amounts(start_day, end_day, category=None):
+    '''Load individual amounts of a day-number range, in integer cents, from the covering index.'''
+    arm = "SELECT amount_cents FROM {schema}.expenses WHERE day BETWEEN ? AND ?"
+    params = [start_day, end_day]
+    if category:
+        arm += " AND " + _category_sql(category, params)
+    with db.reader() as c:
+        cur = c.execute(*_union(_partitions(c, start_day, end_day), arm, params))
+        return np.fromiter(itertools.chain.from_iterable(cur), dtype=np.int64)
+
+def _bucket_starts(days, granularity):
+    '''Map epoch days to the epoch day starting their bucket (Monday-based weeks).'''
+    if granularity == "week":
+        return days - (days + 3) % 7
+    if granularity == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    return days
+
+def _analyze(start_date, end_date, granularity, category, window, percentiles, top_n):
+    start = _parse_date(start_date)
+    end = _parse_date(end_date)
+    if end < start:
+        raise ValueError("end_date is before start_date")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    percentiles = list(DEFAULT_PERCENTILES if percentiles is None else percentiles)
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+    window = max(1, int(window))
+
+    # One load covers the previous period of equal length as well.
+    length = (end - start).days + 1
+    previous_start = start - datetime.timedelta(days=length)
+    start_day = _day_number(start)
+    end_day = _day_number(end)
+    days, cents, counts, codes, pairs = _load_daily_columns(_day_number(previous_start), end_day, category)
+    current = days >= start_day
+    previous_total = int(cents[~current].sum())
+    days, cents, counts, codes = days[current], cents[current], counts[current], codes[current]
+
+    # Dense series over every bucket in the range, including empty ones.
+    bucket = _bucket_starts(days, granularity)
+    if granularity == "month":
+        labels = np.arange(np.datetime64(start, "M"), np.datetime64(end, "M") + 1)
+        index = (bucket.astype("datetime64[D]").astype("datetime64[M]") - labels[0]).astype(np.int64)
+        labels = [str(label) for label in labels]
+    else:
+        step = 7 if granularity == "week" else 1
+        first = int(_bucket_starts(np.array([start_day]), granularity)[0])
+        index = (bucket - first) // step
+        labels = [str(label) for label in np.arange(first, end_day + 1, step).astype("datetime64[D]")]
+    series_totals = np.bincount(index, weights=cents, minlength=len(labels))
+    series_counts = np.bincount(index, weights=counts, minlength=len(labels)).astype(np.int64)
+    if len(series_totals) >= window:
+        moving = np.convolve(series_totals, np.ones(window) / window, mode="valid")
+        moving = [None] * (window - 1) + [money(v) for v in moving]
+    else:
+        moving = [None] * len(series_totals)
+
+    # Totals per (category, subcategory) code, ranked.
+    pair_totals = np.bincount(codes, weights=cents, minlength=len(pairs))
+    pair_counts = np.bincount(codes, weights=counts, minlength=len(pairs)).astype(np.int64)
+    top = np.argsort(-pair_totals, kind="stable")[:max(0, int(top_n))]
+    category_totals = {}
+    for (name, _), total in zip(pairs, pair_totals):
+        category_totals[name] = category_totals.get(name, 0) + total
+
+    amounts = _load_amounts(start_day, end_day, category) if percentiles else None
+    total = int(cents.sum())
+    count = int(counts.sum())
+    return {
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "granularity": granularity,
+        "total": money(total),
+        "count": count,
+        "mean": money(total / count) if count else None,
+        "percentiles": {
+            str(p): money(v) for p, v in zip(percentiles, np.percentile(amounts, percentiles))
+        } if amounts is not None and len(amounts) else {},
+        "series": {
+            "buckets": labels,
+            "totals": [money(v) for v in series_totals],
+            "counts": series_counts.tolist(),
+            "moving_average": moving,
+            "window": window,
+        },
+        "by_category": {name: money(v) for name, v in sorted(category_totals.items()) if v},
+        "top_subcategories": [
+            {"category": pairs[i][0], "subcategory": pairs[i][1], "total": money(pair_totals[i]), "count": int(pair_counts[i])}
+            for i in top if pair_counts[i]
+        ],
+        "previous_period": {
+            "start_date": previous_start.isoformat(),
+            "end_date": (start - datetime.timedelta(days=1)).isoformat(),
+            "total": money(previous_total),
+            "change": money(total - previous_total),
+            "change_pct": round((total - previous_total) * 100 / previous_total, 2) if previous_total else None,
+        },
+    }
+
+@mcp.tool()
+@runner.offload(readers, limit=4)
+def analyze_expenses(start_date, end_date, granularity: str = "month", category: str = None, window: int = 3, percentiles: list[float] = None, top_n: int = 5):
+    '''Compute spending analytics for an inclusive date range in one pass.
+
+    Args:
+        start_date (str): The start date of the range in YYYY-MM-DD format.
+        end_date (str): The end date of the range in YYYY-MM-DD format.
+        granularity (str, optional): Series bucket size: "day", "week" (Monday-based) or "month". Defaults to "month".
+        category (str, optional): Restrict to one category. Defaults to None.
+        window (int, optional): Moving-average window, in buckets. Defaults to 3.
+        percentiles (list, optional): Percentiles of individual expense amounts. Defaults to [50, 90, 99];
+            pass [] to skip them on very large ranges.
+        top_n (int, optional): Number of top subcategories by total. Defaults to 5.
 
-        query += " GROUP BY category ORDER BY category ASC"
+    Returns:
+        dict: Totals, percentiles, the bucketed series with its moving average, per-category
+        totals, top subcategories, and the change versus the previous period of equal length.
+    '''
+    try:
+        start = _parse_date(start_date)
+        end = _parse_date(end_date)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    key = results.key("analyze_expenses", start_date, end_date, granularity, category or None, window, percentiles, top_n)
+    previous_start = start - (end - start) - datetime.timedelta(days=1)
+    try:
+        return results.fetch(
+            key, previous_start.isoformat(), end.isoformat(),
+            lambda: _analyze(start_date, end_date, granularity, category, window, percentiles, top_n)
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
 
-        cur = c.execute(query, params)
+def _search_expenses(query, start_date, end_date, limit, prefix, match_all):
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return {"status": "error", "message": "Query has no searchable words"}
+    # Quote every term so user input is never parsed as FTS5 syntax.
+    match = (" " if match_all else " OR ").join(f'"{t}"*' if prefix else f'"{t}"' for t in terms)
+    try:
+        start_day = _day_number(_parse_date(start_date)) if start_date else None
+        end_day = _day_number(_parse_date(end_date)) if end_date else None
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    # Each partition has its own index, so scores are ranked with that
+    # partition's term statistics before the arms are merged.
+    arm = f"""
+        SELECT e.id, e.date, CAST(e.amount_cents AS REAL) / {MINOR_UNITS} AS amount, e.category, e.subcategory, e.note,
+               -bm25(expenses_fts, 1.0, 0.5, 0.75) AS score
+        FROM {{schema}}.expenses_fts
+        JOIN {{schema}}.expenses e ON e.id = expenses_fts.rowid
+        WHERE expenses_fts MATCH ?
+    """
+    params = [match]
+    if start_day is not None:
+        arm += " AND e.day >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        arm += " AND e.day <= ?"
+        params.append(end_day)
+    with db.reader() as c:
+        sql, params = _union(_partitions(c, start_day, end_day), arm, params)
+        sql += " ORDER BY score DESC LIMIT ?"
+        params.append(min(max(1, limit), MAX_PAGE_SIZE))
+        cur = c.execute(sql, params)
         cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+        rows = cur.fetchall()
+    return [dict(zip(cols, r[:-1]), score=round(r[-1], 4)) for r in rows]
+
+@mcp.tool()
+@runner.offload(readers)
+def search_expenses(query: str, start_date: str = None, end_date: str = None, limit: int = 20, prefix: bool = True, match_all: bool = True):
+    '''Full-text search over expense notes, categories and subcategories, best matches first.
+
+    Args:
+        query (str): Words to look for, e.g. "pharmacy" or "dinner team".
+        start_date (str, optional): Only expenses on or after this date (YYYY-MM-DD).
+        end_date (str, optional): Only expenses on or before this date (YYYY-MM-DD).
+        limit (int, optional): Maximum number of results (max 1000). Defaults to 20.
+        prefix (bool, optional): Match words by prefix, so "pharm" finds "pharmacy". Defaults to True.
+        match_all (bool, optional): Require every word (True) or any word (False). Defaults to True.
+
+    Returns:
+        list: Matching expenses as dictionaries, each with a relevance score.
+    '''
+    key = results.key("search_expenses", query, start_date, end_date, limit, prefix, match_all)
+    return results.fetch(
+        key, start_date or "0000-00-00", end_date or "9999-99-99",
+        lambda: _search_expenses(query, start_date, end_date, limit, prefix, match_all)
+    )
+
+def _expense_changes(date=None, amount=None, category=None, subcategory=None, note=None):
+    '''Validate the fields an update sets; returns ``{column: value}``, raises ValueError.'''
+    changes = {}
+    if date is not None:
+        changes["date"] = _parse_date(date).isoformat()
+    if amount is not None:
+        changes["amount_cents"] = to_cents(amount)
+    if category is not None:
+        changes["category"], resolved_sub = category_tree.resolve(category, subcategory)
+        if subcategory is not None:
+            subcategory = resolved_sub
+    if subcategory is not None:
+        changes["subcategory"] = subcategory
+    if note is not None:
+        changes["note"] = note
+    return changes
 
 @mcp.tool()
-def update_expense(id: int, date: str = None, amount: float = None, category: str = None, subcategory: str = None, note: str = None):
+@runner.gated(limit=WRITE_MAX_PENDING)
+async def update_expense(id: int, date: str = None, amount: float = None, category: str = None, subcategory: str = None, note: str = None):
     '''Update an existing expense by its ID.
 
     Args:
@@ -111,39 +1579,51 @@ def update_expense(id: int, date: str = None, amount: float = None, category: st
     Returns:
         dict: A status message indicating success or failure.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        fields = []
-        values = []
-        if date is not None:
-            fields.append("date = ?")
-            values.append(date)
-        if amount is not None:
-            fields.append("amount = ?")
-            values.append(amount)
-        if category is not None:
-            fields.append("category = ?")
-            values.append(category)
-        if subcategory is not None:
-            fields.append("subcategory = ?")
-            values.append(subcategory)
-        if note is not None:
-            fields.append("note = ?")
-            values.append(note)
-        
-        if not fields:
-            return {"status": "error", "message": "No fields provided for update"}
-        
-        values.append(id)
-        query = f"UPDATE expenses SET {', '.join(fields)} WHERE id = ?"
-        
-        cur = c.execute(query, tuple(values))
-        if cur.rowcount == 0:
+    try:
+        changes = _expense_changes(date, amount, category, subcategory, note)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    if not changes:
+        return {"status": "error", "message": "No fields provided for update"}
+
+    columns = tuple(col for col in STORED_COLUMNS if col in changes)
+    date = changes.get("date")
+    touched = [date]
+
+    def update(c):
+        schema, row = _locate(c, id, "date, category, subcategory")
+        if row is None:
              return {"status": "error", "message": f"Record with id {id} not found"}
-        
+        params = [changes[col] for col in columns]
+        if category is None and subcategory:
+            # Only the subcategory changes: check it against the stored category.
+            try:
+                _, params[columns.index("subcategory")] = category_tree.resolve(row[1], subcategory)
+            except ValueError as e:
+                return {"status": "error", "message": str(e)}
+        elif category is not None and subcategory is None:
+            # Only the category changes: the stored subcategory must belong to it.
+            try:
+                category_tree.resolve(changes["category"], row[2])
+            except ValueError as e:
+                return {"status": "error", "message": f"{e}; pass a subcategory along with the new category"}
+        if schema != "main" and date is not None and not date.startswith(f"{schema[1:]}-"):
+            return {"status": "error", "message": f"Record with id {id} was archived meanwhile; retry the update"}
+        touched.append(row[0])
+        c.execute(EXPENSES.update_sql(columns, schema), [*params, id])
         return {"status": "ok", "updated_id": id}
 
+    if date is not None:
+        # Dated out of its archived year: the row returns to the hot partition first.
+        await writers.run(_unarchive, "id = ?", (id,), date)
+    result = await asyncio.wrap_future(writes.submit(update))
+    if result["status"] == "ok":
+        results.invalidate(*touched)
+    return result
+
 @mcp.tool()
-def delete_expense(id: int):
+@runner.gated(limit=WRITE_MAX_PENDING)
+async def delete_expense(id: int):
     '''Delete an expense from the database by its ID.
 
     Args:
@@ -152,18 +1632,233 @@ def delete_expense(id: int):
     Returns:
         dict: A status message indicating success or failure.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute("DELETE FROM expenses WHERE id = ?", (id,))
-        if cur.rowcount == 0:
+    touched = []
+
+    def delete(c):
+        schema, row = _locate(c, id)
+        if row is None:
             return {"status": "error", "message": f"Record with id {id} not found"}
+        touched.append(row[0])
+        c.execute(EXPENSES.delete_sql(schema), (id,))
         return {"status": "ok", "deleted_id": id}
 
+    result = await asyncio.wrap_future(writes.submit(delete))
+    if result["status"] == "ok":
+        results.invalidate(*touched)
+    return result
+
+def _batch_selection(ids, start_date, end_date, category):
+    '''Turn a batch edit's row selection into ``(where, params, start_day, end_day)``; raises ValueError.
+
+    Rows are named either by ``ids`` or by an inclusive date range, and either
+    way can be narrowed to one ``category``.
+    '''
+    where, params = EXPENSES.selection_sql(ids, start_date, end_date, {"category": category or None})
+    start_day, end_day = (None, None) if ids is not None else _day_range(start_date, end_date)
+    return where, params, start_day, end_day
+
+def _batch_targets(c, where, params, start_day, end_day):
+    '''Rows a batch edit selects, as ``{schema: [(id, date, category, subcategory), ...]}``.
+
+    Raises ValueError if they number more than BATCH_MAX_ROWS.
+    '''
+    targets = {}
+    found = 0
+    for schema in _partitions(c, start_day, end_day):
+        rows = c.execute(
+            f"SELECT id, date, category, subcategory FROM {schema}.expenses WHERE {where} LIMIT ?",
+            [*params, BATCH_MAX_ROWS + 1 - found]
+        ).fetchall()
+        if rows:
+            targets[schema] = rows
+            found += len(rows)
+        if found > BATCH_MAX_ROWS:
+            raise ValueError(f"More than {BATCH_MAX_ROWS} expenses selected; narrow the selection")
+    return targets
+
+def _batch_edit(ids, start_date, end_date, category, dry_run, apply, new_date=None):
+    '''Select rows for a batch edit and, unless ``dry_run``, call ``apply(c, targets)`` in one transaction.
+
+    Batches are already one transaction, so they take the writer directly
+    instead of a savepoint in the write batcher. Archived rows that ``new_date``
+    takes out of their year are moved back to main before that transaction.
+    '''
+    try:
+        where, params, start_day, end_day = _batch_selection(ids, start_date, end_date, category)
+        if new_date is not None and not dry_run:
+            _unarchive(where, params, new_date, start_day, end_day)
+        with (db.reader() if dry_run else db.transaction()) as c:
+            targets = _batch_targets(c, where, params, start_day, end_day)
+            changed = None if dry_run else apply(c, targets)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, []
+
+    rows = [row for schema_rows in targets.values() for row in schema_rows]
+    result = {"status": "ok", "matched": len(rows)}
+    if ids is not None:
+        missing = sorted(set(ids) - {row[0] for row in rows})
+        if missing:
+            result["status"] = "partial"
+            result["unmatched_ids"] = missing
+    if dry_run:
+        result["dry_run"] = True
+    else:
+        result["changed"] = changed
+    return result, [row[1] for row in rows]
+
+@mcp.tool()
+@runner.offload(writers, limit=4)
+def update_expenses(changes: dict, ids: list[int] = None, start_date: str = None, end_date: str = None, category: str = None, dry_run: bool = False):
+    '''Apply the same changes to many expenses in one transaction.
+
+    Select the expenses either by ids or by an inclusive date range; both can
+    be narrowed to one category. Either all of them are updated or none are.
+
+    Args:
+        changes (dict): Fields to set, as in update_expense: date, amount, category,
+            subcategory and note.
+        ids (list, optional): IDs of the expenses to update.
+        start_date (str, optional): Start of the date range in YYYY-MM-DD format.
+        end_date (str, optional): End of the date range in YYYY-MM-DD format.
+        category (str, optional): Only update expenses currently in this category.
+        dry_run (bool, optional): Only count the expenses that would change. Defaults to False.
+
+    Returns:
+        dict: The number of expenses matched and changed, plus any requested ids that matched nothing.
+    '''
+    if not isinstance(changes, dict):
+        return {"status": "error", "message": "changes must be an object"}
+    unknown = sorted(set(changes) - {"date", "amount", "category", "subcategory", "note"})
+    if unknown:
+        return {"status": "error", "message": f"Unknown fields in changes: {', '.join(unknown)}"}
+    try:
+        values = _expense_changes(**changes)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    if not values:
+        return {"status": "error", "message": "No fields provided for update"}
+
+    columns = tuple(col for col in STORED_COLUMNS if col in values)
+    new_date = values.get("date")
+    # Only the subcategory changes: it must fit every selected row's category.
+    sub_only = "category" not in values and values.get("subcategory")
+    # Only the category changes: every selected row's subcategory must fit it.
+    category_only = "category" in values and "subcategory" not in values
+
+    def apply(c, targets):
+        subcategories = {}
+        if sub_only:
+            for name in {row[2] for schema_rows in targets.values() for row in schema_rows}:
+                subcategories[name] = category_tree.resolve(name, values["subcategory"])[1]
+        if category_only:
+            for sub in {row[3] for schema_rows in targets.values() for row in schema_rows}:
+                try:
+                    category_tree.resolve(values["category"], sub)
+                except ValueError as e:
+                    raise ValueError(f"{e}; pass a subcategory along with the new category") from None
+        changed = 0
+        for schema, schema_rows in targets.items():
+            if schema != "main" and new_date is not None and not new_date.startswith(f"{schema[1:]}-"):
+                raise ValueError("Some of the expenses were archived meanwhile; retry the update")
+            params = [values[col] for col in columns]
+            if sub_only:
+                at = columns.index("subcategory")
+                rows = ([*params[:at], subcategories[row[2]], *params[at + 1:], row[0]] for row in schema_rows)
+            else:
+                rows = ([*params, row[0]] for row in schema_rows)
+            changed += c.executemany(EXPENSES.update_sql(columns, schema), rows).rowcount
+        return changed
+
+    result, dates = _batch_edit(ids, start_date, end_date, category, dry_run, apply, new_date)
+    if result.get("changed"):
+        dates.append(new_date)
+        results.invalidate_range(min(d for d in dates if d), max(d for d in dates if d))
+    return result
+
+@mcp.tool()
+@runner.offload(writers, limit=4)
+def delete_expenses(ids: list[int] = None, start_date: str = None, end_date: str = None, category: str = None, dry_run: bool = False):
+    '''Delete many expenses in one transaction.
+
+    Select the expenses either by ids or by an inclusive date range; both can
+    be narrowed to one category. Either all of them are deleted or none are.
+
+    Args:
+        ids (list, optional): IDs of the expenses to delete.
+        start_date (str, optional): Start of the date range in YYYY-MM-DD format.
+        end_date (str, optional): End of the date range in YYYY-MM-DD format.
+        category (str, optional): Only delete expenses in this category.
+        dry_run (bool, optional): Only count the expenses that would be deleted. Defaults to False.
+
+    Returns:
+        dict: The number of expenses matched and deleted, plus any requested ids that matched nothing.
+    '''
+    def apply(c, targets):
+        return sum(
+            c.executemany(EXPENSES.delete_sql(schema), ((row[0],) for row in schema_rows)).rowcount
+            for schema, schema_rows in targets.items()
+        )
+
+    result, dates = _batch_edit(ids, start_date, end_date, category, dry_run, apply)
+    if result.get("changed"):
+        results.invalidate_range(min(dates), max(dates))
+    return result
+
+@mcp.resource("expense://health", mime_type="application/json")
+def health():
+    # Liveness of the writer and read pool, for probes and dashboards
+    return json.dumps(db.health())
+
+@mcp.resource("expense://metrics", mime_type="application/json")
+def metrics():
+    # Group-commit batch sizes, write queue depth and result cache hit rates of
+    # the caller's shard, plus occupancy of the shard pool, lanes and tool gates
+    return json.dumps({
+        "write_batch": writes.stats(),
+        "result_cache": results.stats(),
+        "shards": shards.stats(),
+        **runner.stats(),
+    })
+
 @mcp.resource("expense://categories", mime_type="application/json")
 def categories():
-    # Read fresh each time so you can edit the file without restarting
-    with open(CATEGORIES_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+    # Served from memory; a cheap stat picks up edits without restarting
+    return category_tree.refresh().text
+
+@mcp.resource("expense://categories/etag", mime_type="application/json")
+def categories_etag():
+    # Compare with the last seen etag to skip refetching expense://categories
+    tree = category_tree.refresh()
+    return json.dumps({"etag": tree.etag, "modified": tree.modified})
 
 if __name__ == "__main__":
-    #mcp.run() #default stdio transport
-    mcp.run(transport="http", host="0.0.0.0", port=8000) #http transport on port 8000 by default
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Expense tracker MCP server")
+    parser.add_argument(
+        "command", nargs="?", default="serve",
+        choices=["serve", "rebuild-rollups", "check-rollups", "rebuild-search-index", "archive"],
+        help="run the server (default) or a maintenance command",
+    )
+    parser.add_argument("--year", type=int, help="closed year to move into its archive file (archive)")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT, help="tenant whose database a maintenance command runs on")
+    args = parser.parse_args()
+    if not TENANT_ID_RE.fullmatch(args.tenant):
+        parser.error("invalid --tenant")
+
+    if args.command != "serve":
+        with use_tenant(args.tenant):
+            if args.command == "rebuild-rollups":
+                rebuild_rollups()
+                print(json.dumps(check_rollups(), indent=2))
+            elif args.command == "check-rollups":
+                print(json.dumps(check_rollups(), indent=2))
+            elif args.command == "rebuild-search-index":
+                rebuild_search_index()
+            elif args.command == "archive":
+                if args.year is None:
+                    parser.error("archive needs --year")
+                print(json.dumps(archive_year(args.year), indent=2))
+    else:
+        #mcp.run() #default stdio transport
+        mcp.run(transport="http", host="0.0.0.0", port=8000) #http transport on port 8000 by default
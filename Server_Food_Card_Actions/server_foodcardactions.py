@@ -1,124 +1,579 @@
 from fastmcp import FastMCP
+import atexit
+import datetime
+import itertools
+import json
 import os
-import sqlite3
+import sys
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "FoodCardActions.db")
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp_tables import (
+    MINOR_UNITS,
+    Column,
+    Database,
+    ShardPool,
+    Table,
+    Tenancy,
+    ToolRunner,
+    decode_cursor,
+    encode_cursor,
+    migrate,
+    money,
+    page_size,
+    to_cents,
+)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FoodCardActions.db")
+
+# Each tenant database has one writer connection and up to READ_POOL_SIZE
+# read-only connections; a call waits at most POOL_TIMEOUT seconds for one.
+READ_POOL_SIZE = int(os.getenv("FOODCARD_READ_POOL_SIZE", "4"))
+POOL_TIMEOUT = float(os.getenv("FOODCARD_POOL_TIMEOUT", "5"))
+
+# Tenancy: each tenant, named by the TENANT_HEADER request header, gets its own
+# database under TENANT_DIR; requests without the header use DB_PATH. At most
+# SHARD_MAX_OPEN tenant databases stay open, idle ones close after SHARD_IDLE_TIMEOUT seconds.
+TENANT_HEADER = os.getenv("FOODCARD_TENANT_HEADER", "x-tenant-id").lower()
+TENANT_DIR = os.getenv("FOODCARD_TENANT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tenants"))
+SHARD_MAX_OPEN = int(os.getenv("FOODCARD_SHARD_MAX_OPEN", "32"))
+SHARD_IDLE_TIMEOUT = float(os.getenv("FOODCARD_SHARD_IDLE_TIMEOUT", "300"))
+
+# Tools run their blocking SQLite work on two bounded thread pools ("lanes"),
+# one for reads and one for writes. Each lane queues at most LANE_MAX_QUEUE
+# calls beyond its busy workers and each tool runs at most TOOL_MAX_CONCURRENCY
+# calls at once with TOOL_MAX_WAITING more waiting; past either limit a call
+# is refused immediately instead of piling up.
+READER_WORKERS = int(os.getenv("FOODCARD_READER_WORKERS", str(max(4, os.cpu_count() or 1))))
+WRITER_WORKERS = int(os.getenv("FOODCARD_WRITER_WORKERS", "4"))
+LANE_MAX_QUEUE = int(os.getenv("FOODCARD_LANE_MAX_QUEUE", "256"))
+TOOL_MAX_CONCURRENCY = int(os.getenv("FOODCARD_TOOL_MAX_CONCURRENCY", "16"))
+TOOL_MAX_WAITING = int(os.getenv("FOODCARD_TOOL_MAX_WAITING", "64"))
+
+# The most rows one batch edit may touch, and one unpaged list may return.
+BATCH_MAX_ROWS = int(os.getenv("FOODCARD_BATCH_MAX_ROWS", "50000"))
+UNPAGED_MAX_ROWS = int(os.getenv("FOODCARD_UNPAGED_MAX_ROWS", "10000"))
 
 mcp = FastMCP("FoodCardTracker")
 
-def init_db():
-    with sqlite3.connect(DB_PATH) as c:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS cardactions(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                cardnumber TEXT NOT NULL,
-                cardaction TEXT DEFAULT '',
-                note TEXT DEFAULT ''
-            )
-        """)
+# Amounts are stored in minor units (MINOR_UNITS per currency unit). A RELOAD
+# adds its amount to the card's balance, a SPEND deducts it and any other
+# action (BLOCK, ...) leaves the balance alone.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 5000
+MAX_WINDOW_DAYS = 366
+EPOCH = datetime.date(1970, 1, 1)
 
-init_db()
+# How summarize_card_actions buckets dates; a week is named by its Monday.
+PERIODS = {
+    "day": "date",
+    "week": "date(date, '-6 days', 'weekday 1')",
+    "month": "substr(date, 1, 7)",
+    "year": "substr(date, 1, 4)",
+    "all": "NULL",
+}
 
-@mcp.tool()
-def add_card_action(date, cardnumber, cardaction, note=""):
-    '''Add a new food card action to the database.
+def _to_cents(value):
+    '''Convert a non-negative amount in currency units (12.5, "12.50") to integer minor units; raises ValueError.'''
+    cents = to_cents(value)
+    if cents < 0:
+        raise ValueError("amount must not be negative; the action type decides whether it is added or deducted")
+    return cents
 
-    Args:
-        date (str): The date of the transaction in YYYY-MM-DD format.
-        cardnumber (str): The identifier for the food card.
-        cardaction (str): The type of action (e.g., 'RELOAD', 'SPEND').
-        note (str, optional): Additional notes about the transaction. Defaults to "".
-    '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            "INSERT INTO cardactions(date, cardnumber, cardaction, note) VALUES (?,?,?,?)",
-            (date, cardnumber, cardaction, note)
+def _balance_parts(row):
+    '''SQL for how ``row`` (NEW, OLD or a table alias) moves its card's balance, reloads and spending.'''
+    reloaded = f"CASE upper({row}.cardaction) WHEN 'RELOAD' THEN {row}.amount_cents ELSE 0 END"
+    spent = f"CASE upper({row}.cardaction) WHEN 'SPEND' THEN {row}.amount_cents ELSE 0 END"
+    return f"({reloaded}) - ({spent})", reloaded, spent
+
+BALANCES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS card_balances(
+        cardnumber TEXT PRIMARY KEY,
+        balance_cents INTEGER NOT NULL,
+        reloaded_cents INTEGER NOT NULL,
+        spent_cents INTEGER NOT NULL,
+        actions INTEGER NOT NULL,
+        last_date TEXT
+    ) WITHOUT ROWID
+"""
+
+def _balance_add_sql(row="NEW"):
+    delta, reloaded, spent = _balance_parts(row)
+    return f"""
+        INSERT INTO card_balances(cardnumber, balance_cents, reloaded_cents, spent_cents, actions, last_date)
+        VALUES ({row}.cardnumber, {delta}, {reloaded}, {spent}, 1, {row}.date)
+        ON CONFLICT(cardnumber) DO UPDATE SET
+            balance_cents = balance_cents + excluded.balance_cents,
+            reloaded_cents = reloaded_cents + excluded.reloaded_cents,
+            spent_cents = spent_cents + excluded.spent_cents,
+            actions = actions + 1,
+            last_date = max(last_date, excluded.last_date);
+    """
+
+def _balance_remove_sql(row="OLD"):
+    delta, reloaded, spent = _balance_parts(row)
+    # The latest remaining date comes from idx_cardactions_card_date, so this stays a lookup.
+    return f"""
+        UPDATE card_balances SET
+            balance_cents = balance_cents - ({delta}),
+            reloaded_cents = reloaded_cents - ({reloaded}),
+            spent_cents = spent_cents - ({spent}),
+            actions = actions - 1,
+            last_date = (SELECT max(date) FROM cardactions WHERE cardnumber = {row}.cardnumber)
+        WHERE cardnumber = {row}.cardnumber;
+        DELETE FROM card_balances WHERE cardnumber = {row}.cardnumber AND actions <= 0;
+    """
+
+BALANCE_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS cardactions_balance_insert",
+    "DROP TRIGGER IF EXISTS cardactions_balance_update",
+    "DROP TRIGGER IF EXISTS cardactions_balance_delete",
+    f"CREATE TRIGGER cardactions_balance_insert AFTER INSERT ON cardactions BEGIN {_balance_add_sql()} END",
+    f"""CREATE TRIGGER cardactions_balance_update AFTER UPDATE OF date, cardnumber, cardaction, amount_cents ON cardactions
+        BEGIN {_balance_remove_sql()} {_balance_add_sql()} END""",
+    f"CREATE TRIGGER cardactions_balance_delete AFTER DELETE ON cardactions BEGIN {_balance_remove_sql()} END",
+]
+
+def _rebuild_balances(c):
+    '''Recompute every card's balance row from cardactions.'''
+    delta, reloaded, spent = _balance_parts("a")
+    c.execute("DELETE FROM card_balances")
+    c.execute(f"""
+        INSERT INTO card_balances(cardnumber, balance_cents, reloaded_cents, spent_cents, actions, last_date)
+        SELECT a.cardnumber, SUM({delta}), SUM({reloaded}), SUM({spent}), COUNT(*), MAX(a.date)
+        FROM cardactions AS a GROUP BY a.cardnumber
+    """)
+
+# One row per window length scanned by scan_card_anomalies: the last action id
+# folded in, the cards in array order and their CardWindows arrays.
+SCAN_STATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS card_scan_state(
+        window_days INTEGER PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        cards TEXT NOT NULL,
+        state BLOB NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+"""
+
+# Saved windows only fold in actions added after last_id, so editing or deleting
+# an action they already hold drops them and the next scan starts over.
+SCAN_STATE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS cardactions_scan_state_update
+        AFTER UPDATE OF date, cardnumber, cardaction, amount_cents ON cardactions
+        BEGIN DELETE FROM card_scan_state WHERE last_id >= old.id; END""",
+    """CREATE TRIGGER IF NOT EXISTS cardactions_scan_state_delete AFTER DELETE ON cardactions
+        BEGIN DELETE FROM card_scan_state WHERE last_id >= old.id; END""",
+]
+
+# Ordered schema migrations: (version, description, steps). A step is SQL or a
+# callable taking the connection. Each migration runs once, in its own
+# transaction, and is recorded in schema_version.
+MIGRATIONS = [
+    (1, "create cardactions table", [
+        """
+        CREATE TABLE IF NOT EXISTS cardactions(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            cardnumber TEXT NOT NULL,
+            cardaction TEXT DEFAULT '',
+            note TEXT DEFAULT ''
         )
-        return {"status": "ok", "id": cur.lastrowid}
-    
+        """,
+    ]),
+    (2, "amounts and per-card balances maintained by triggers", [
+        # Actions recorded before amounts existed count as zero.
+        "ALTER TABLE cardactions ADD COLUMN amount_cents INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_cardactions_card_date ON cardactions(cardnumber, date)",
+        BALANCES_TABLE_SQL,
+        *BALANCE_TRIGGERS,
+        _rebuild_balances,
+    ]),
+    # With the rowid each index ends in, every one also yields (date, id) order
+    # for keyset pages. Action types are matched case-insensitively.
+    (3, "composite indexes for date, card and action filters", [
+        "CREATE INDEX IF NOT EXISTS idx_cardactions_date ON cardactions(date)",
+        "CREATE INDEX IF NOT EXISTS idx_cardactions_action_date ON cardactions(cardaction COLLATE NOCASE, date)",
+        "CREATE INDEX IF NOT EXISTS idx_cardactions_card_action_date ON cardactions(cardnumber, cardaction COLLATE NOCASE, date)",
+    ]),
+    # Full anomaly scans and unfiltered summaries group by date and card; the
+    # widened date index serves them without touching the table.
+    (4, "saved sliding-window state for incremental anomaly scans", [
+        SCAN_STATE_TABLE_SQL,
+        "DROP INDEX IF EXISTS idx_cardactions_date",
+        "CREATE INDEX IF NOT EXISTS idx_cardactions_date_card ON cardactions(date, cardnumber, cardaction, amount_cents)",
+    ]),
+    # States saved before these triggers may already miss an edit.
+    (5, "drop saved anomaly scan state when scanned actions change", [
+        *SCAN_STATE_TRIGGERS,
+        "DELETE FROM card_scan_state",
+    ]),
+]
+
+def open_database(path):
+    '''Open the database at ``path``, creating or upgrading it first.'''
+    database = Database(path, read_pool_size=READ_POOL_SIZE, timeout=POOL_TIMEOUT)
+    try:
+        migrate(database, MIGRATIONS)
+    except BaseException:
+        database.close()
+        raise
+    return database
+
+def open_tenant(tenant):
+    path = os.path.join(TENANT_DIR, tenant, "FoodCardActions.db")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open_database(path)
+
+shards = ShardPool(open_database(DB_PATH), open_tenant, SHARD_MAX_OPEN, SHARD_IDLE_TIMEOUT, name="foodcard")
+atexit.register(shards.close)
+
+# Every tool call and resource read runs against the caller's tenant database,
+# reached through the db proxy.
+tenancy = Tenancy(shards, TENANT_HEADER, name="foodcard")
+mcp.add_middleware(tenancy.middleware())
+db = tenancy.attribute()
+
+runner = ToolRunner("foodcard", READER_WORKERS, WRITER_WORKERS, LANE_MAX_QUEUE, TOOL_MAX_CONCURRENCY, TOOL_MAX_WAITING)
+atexit.register(runner.close)
+readers, writers = runner.readers, runner.writers
+
+CARD_ACTIONS = Table(
+    "cardactions", "food card action",
+    [
+        Column("date", "The date of the transaction in YYYY-MM-DD format.", required=True,
+               update_doc="New date in YYYY-MM-DD format."),
+        Column("cardnumber", "The identifier for the food card.", required=True, match="exact",
+               update_doc="New card number.", match_doc="actions on this card"),
+        Column("cardaction", "The type of action (e.g., 'RELOAD', 'SPEND').", required=True, match="nocase",
+               update_doc="New action type.", match_doc="actions of this type"),
+        Column("amount", "Money moved by the action, never negative: a RELOAD adds it to the card's balance, "
+               "a SPEND deducts it. Defaults to 0.", type=float, default=0, store="amount_cents", parse=_to_cents,
+               select=f"CAST(amount_cents AS REAL) / {MINOR_UNITS}", update_doc="New amount, never negative."),
+        Column("note", 'Additional notes about the transaction. Defaults to "".', default="", update_doc="New note."),
+    ],
+    page_size=PAGE_SIZE, max_page_size=MAX_PAGE_SIZE, batch_max_rows=BATCH_MAX_ROWS,
+    unpaged_max_rows=UNPAGED_MAX_ROWS,
+)
+
+CARD_ACTIONS.register(mcp, runner, db, {
+    "add": "add_card_action",
+    "list": "list_card_actions",
+    "update": "update_card_action",
+    "delete": "delete_card_action",
+    "update_many": "update_card_actions",
+    "delete_many": "delete_card_actions",
+})
+
+def _action_filter(start_date, end_date, cardnumber=None, cardaction=None):
+    '''WHERE clause and params for an inclusive date range, optionally narrowed to one card and action type.'''
+    return CARD_ACTIONS.filter_sql(
+        "date BETWEEN ? AND ?", [start_date, end_date], {"cardnumber": cardnumber, "cardaction": cardaction}
+    )
+
 @mcp.tool()
-def list_card_actions(start_date, end_date):
-    '''List food card entries within an inclusive date range.
+@runner.offload(readers)
+def summarize_card_actions(start_date, end_date, period: str = "month", cardnumber: str = None, cardaction: str = None):
+    '''Count and total food card actions per period, card and action type within an inclusive date range.
 
     Args:
         start_date (str): The start date of the range in YYYY-MM-DD format.
         end_date (str): The end date of the range in YYYY-MM-DD format.
+        period (str, optional): "day", "week" (named by its Monday), "month", "year" or
+            "all" (the whole range). Defaults to "month".
+        cardnumber (str, optional): Only actions on this card.
+        cardaction (str, optional): Only actions of this type (case-insensitive).
 
     Returns:
-        list: A list of dictionaries, each representing a card action.
+        list: A dict per period, card and action type with the number of actions and their total amount.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute(
-            """
-            SELECT id, date, cardnumber, cardaction, note
-            FROM cardactions
-            WHERE date BETWEEN ? AND ?
-            ORDER BY id ASC
+    if period not in PERIODS:
+        return {"status": "error", "message": f"period must be one of: {', '.join(PERIODS)}"}
+    where, params = _action_filter(start_date, end_date, cardnumber, cardaction)
+    with db.reader() as c:
+        rows = c.execute(
+            f"""
+            SELECT {PERIODS[period]} AS period, cardnumber, upper(cardaction), COUNT(*), SUM(amount_cents)
+            FROM cardactions WHERE {where}
+            GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
             """,
-            (start_date, end_date)
-        )
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in cur.fetchall()]
+            params
+        ).fetchall()
+    return [
+        {"period": bucket, "cardnumber": card, "cardaction": action, "count": count, "total_amount": money(total)}
+        for bucket, card, action, count, total in rows
+    ]
 
 @mcp.tool()
-def update_card_action(id: int, date: str = None, cardnumber: str = None, cardaction: str = None, note: str = None):
-    '''Update an existing food card action by its ID.
+@runner.offload(readers)
+def get_card_balance(cardnumber: str):
+    '''Get a food card's current balance, kept up to date as actions are added, changed or deleted.
 
     Args:
-        id (int): The ID of the record to update.
-        date (str, optional): New date in YYYY-MM-DD format.
-        cardnumber (str, optional): New card number.
-        cardaction (str, optional): New action type.
-        note (str, optional): New note.
+        cardnumber (str): The identifier for the food card.
 
     Returns:
-        dict: A status message indicating success or failure.
+        dict: The balance, the totals reloaded and spent, the number of actions and the latest action date.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        # Construct the UPDATE query dynamically based on provided fields
-        fields = []
-        values = []
-        if date is not None:
-            fields.append("date = ?")
-            values.append(date)
-        if cardnumber is not None:
-            fields.append("cardnumber = ?")
-            values.append(cardnumber)
-        if cardaction is not None:
-            fields.append("cardaction = ?")
-            values.append(cardaction)
-        if note is not None:
-            fields.append("note = ?")
-            values.append(note)
-        
-        if not fields:
-            return {"status": "error", "message": "No fields provided for update"}
-        
-        values.append(id)
-        query = f"UPDATE cardactions SET {', '.join(fields)} WHERE id = ?"
-        
-        cur = c.execute(query, tuple(values))
-        if cur.rowcount == 0:
-             return {"status": "error", "message": f"Record with id {id} not found"}
-        
-        return {"status": "ok", "updated_id": id}
+    with db.reader() as c:
+        row = c.execute(
+            "SELECT balance_cents, reloaded_cents, spent_cents, actions, last_date FROM card_balances WHERE cardnumber = ?",
+            (cardnumber,)
+        ).fetchone()
+    if row is None:
+        return {"status": "error", "message": f"No actions recorded for card {cardnumber}"}
+    balance, reloaded, spent, actions, last_date = row
+    return {
+        "cardnumber": cardnumber,
+        "balance": money(balance),
+        "reloaded": money(reloaded),
+        "spent": money(spent),
+        "actions": actions,
+        "last_date": last_date,
+    }
 
 @mcp.tool()
-def delete_card_action(id: int):
-    '''Delete a food card action from the database by its ID.
+@runner.offload(readers)
+def get_card_history(cardnumber: str, start_date: str = None, end_date: str = None, limit: int = PAGE_SIZE, cursor: str = None):
+    '''List one food card's actions, newest first, a page at a time.
 
     Args:
-        id (int): The ID of the record to delete.
+        cardnumber (str): The identifier for the food card.
+        start_date (str, optional): Only actions on or after this date (YYYY-MM-DD).
+        end_date (str, optional): Only actions on or before this date (YYYY-MM-DD).
+        limit (int, optional): Page size (max 1000). Defaults to 50.
+        cursor (str, optional): The next_cursor value of the previous page.
 
     Returns:
-        dict: A status message indicating success or failure.
+        dict: "items" (the card's actions) and "next_cursor" (None on the last page).
+    '''
+    limit = page_size(limit, PAGE_SIZE, MAX_PAGE_SIZE)
+    # Served from idx_cardactions_card_date, which also holds the id tiebreak.
+    query = f"""
+        SELECT id, date, cardaction, CAST(amount_cents AS REAL) / {MINOR_UNITS} AS amount, note
+        FROM cardactions WHERE cardnumber = ?
+    """
+    params = [cardnumber]
+    if start_date is not None:
+        query += " AND date >= ?"
+        params.append(start_date)
+    if end_date is not None:
+        query += " AND date <= ?"
+        params.append(end_date)
+    if cursor is not None:
+        try:
+            before = decode_cursor(cursor, (str, int))
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        query += " AND (date, id) < (?, ?)"
+        params.extend(before)
+    query += " ORDER BY date DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    with db.reader() as c:
+        cur = c.execute(query, params)
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return {"cardnumber": cardnumber, "items": [dict(zip(cols, r)) for r in rows[:limit]], "next_cursor": next_cursor}
+
+class CardWindows:
+    '''Per-card totals over a sliding window of the last ``window_days`` days, held in numpy arrays.
+
+    Each card owns a row of ``window_days`` day buckets, indexed by day number
+    modulo the window and stamped with the day they hold, for its SPEND and
+    RELOAD counts and amounts. Memory grows with the number of cards, never
+    with the number of actions. Days should be fed in order: an action dated a
+    whole window or more before its bucket's newest day falls in no window, and
+    a window only counts buckets dated up to the day that ends it.
     '''
-    with sqlite3.connect(DB_PATH) as c:
-        cur = c.execute("DELETE FROM cardactions WHERE id = ?", (id,))
-        if cur.rowcount == 0:
-            return {"status": "error", "message": f"Record with id {id} not found"}
-        return {"status": "ok", "deleted_id": id}
+
+    FIELDS = ("spends", "spent", "reloads", "reloaded")
+    AMOUNTS = ("spent", "reloaded")
+    EMPTY = -(2 ** 62)
+
+    def __init__(self, window_days, cards=(), state=None):
+        self.window_days = window_days
+        self.cards = list(cards)
+        self.index = {card: i for i, card in enumerate(self.cards)}
+        n = len(self.cards)
+        if state is None:
+            self.stamps = np.full((n, window_days), self.EMPTY, dtype=np.int64)
+            self.sums = np.zeros((len(self.FIELDS), n, window_days), dtype=np.int64)
+        else:
+            saved = np.frombuffer(state, dtype=np.int64).reshape(1 + len(self.FIELDS), n, window_days)
+            self.stamps, self.sums = saved[0].copy(), saved[1:].copy()
+        # Highest window totals seen by this scan, and the day each window ended.
+        self.peaks = np.zeros((len(self.FIELDS), n), dtype=np.int64)
+        self.peak_days = np.zeros((len(self.FIELDS), n), dtype=np.int64)
+
+    def _rows(self, cards):
+        for card in cards:
+            if card not in self.index:
+                self.index[card] = len(self.cards)
+                self.cards.append(card)
+        capacity = self.stamps.shape[0]
+        if len(self.cards) > capacity:
+            extra = max(len(self.cards), 2 * capacity, 64) - capacity
+            self.stamps = np.concatenate([self.stamps, np.full((extra, self.window_days), self.EMPTY, dtype=np.int64)])
+            self.sums = np.concatenate([self.sums, np.zeros((len(self.FIELDS), extra, self.window_days), dtype=np.int64)], axis=1)
+            self.peaks = np.concatenate([self.peaks, np.zeros((len(self.FIELDS), extra), dtype=np.int64)], axis=1)
+            self.peak_days = np.concatenate([self.peak_days, np.zeros((len(self.FIELDS), extra), dtype=np.int64)], axis=1)
+        return np.fromiter((self.index[card] for card in cards), dtype=np.int64, count=len(cards))
+
+    def add_day(self, day, cards, values):
+        '''Fold one day's totals for distinct ``cards`` (``values`` is FIELDS x cards); returns which were in time.'''
+        rows = self._rows(cards)
+        slot = day % self.window_days
+        in_time = self.stamps[rows, slot] <= day
+        rows, values = rows[in_time], values[:, in_time]
+        stale = rows[self.stamps[rows, slot] < day]
+        self.sums[:, stale, slot] = 0
+        self.stamps[rows, slot] = day
+        self.sums[:, rows, slot] += values
+
+        stamps = self.stamps[rows]
+        live = (stamps > day - self.window_days) & (stamps <= day)
+        totals = (self.sums[:, rows] * live).sum(axis=2)
+        higher = totals > self.peaks[:, rows]
+        self.peaks[:, rows] = np.where(higher, totals, self.peaks[:, rows])
+        self.peak_days[:, rows] = np.where(higher, day, self.peak_days[:, rows])
+        return in_time
+
+    def state(self):
+        n = len(self.cards)
+        return np.concatenate([self.stamps[None, :n], self.sums[:, :n]]).tobytes()
+
+
+def _daily_card_totals(c, after_id, last_id):
+    '''Stream (day, cardnumber, actions, spends, spent, reloads, reloaded) per card and date, in date order.'''
+    # A few new actions are found by id; a full scan (``+id`` keeps the planner
+    # off the rowid) walks idx_cardactions_date_card, already grouped.
+    ids = "id > ? AND id <= ?" if after_id else "+id <= ?"
+    cur = c.execute(
+        f"""
+        SELECT CAST(julianday(date) - 2440587.5 AS INTEGER), cardnumber, COUNT(*),
+               SUM(upper(cardaction) = 'SPEND'), SUM(CASE upper(cardaction) WHEN 'SPEND' THEN amount_cents ELSE 0 END),
+               SUM(upper(cardaction) = 'RELOAD'), SUM(CASE upper(cardaction) WHEN 'RELOAD' THEN amount_cents ELSE 0 END)
+        FROM cardactions
+        WHERE {ids} AND julianday(date) IS NOT NULL
+        GROUP BY date, cardnumber ORDER BY date
+        """,
+        (after_id, last_id) if after_id else (last_id,)
+    )
+    while chunk := cur.fetchmany(STREAM_CHUNK_SIZE):
+        yield from chunk
+
+@mcp.tool()
+@runner.offload(writers, limit=1)
+def scan_card_anomalies(window_days: int = 7, max_spends: int = 20, max_spend_amount: float = None, max_reloads: int = 3, max_reload_amount: float = None, resume: bool = True, limit: int = 100):
+    '''Flag cards with bursts of SPEND actions or unusual reloads within a sliding window of days.
+
+    Actions are scanned in date order. Every window_days-day window of each
+    card is checked against the thresholds; a card is reported once per rule,
+    with its highest window. The window state is saved, so the next scan with
+    the same window_days only reads actions added since (an action dated a
+    whole window before the card's latest scanned activity is skipped).
+    Editing or deleting an already scanned action discards the saved state, and
+    the next scan reads every action again.
+
+    Args:
+        window_days (int, optional): Length of the sliding window in days (max 366). Defaults to 7.
+        max_spends (int, optional): Most SPEND actions allowed in one window. Defaults to 20.
+        max_spend_amount (float, optional): Most money spent in one window. Not checked by default.
+        max_reloads (int, optional): Most RELOAD actions allowed in one window. Defaults to 3.
+        max_reload_amount (float, optional): Most money reloaded in one window. Not checked by default.
+        resume (bool, optional): Continue from the previous scan with this window_days; False
+            rescans every action. Defaults to True.
+        limit (int, optional): Most anomalies to return, largest overshoot first. Defaults to 100.
+
+    Returns:
+        dict: The id range and number of actions scanned, the number of anomalies and the
+        anomalies themselves (card, rule, window total, threshold and the window's last day).
+    '''
+    if isinstance(window_days, bool) or not isinstance(window_days, int) or not 1 <= window_days <= MAX_WINDOW_DAYS:
+        return {"status": "error", "message": f"window_days must be between 1 and {MAX_WINDOW_DAYS}"}
+    try:
+        thresholds = [
+            None if max_spends is None else int(max_spends),
+            None if max_spend_amount is None else _to_cents(max_spend_amount),
+            None if max_reloads is None else int(max_reloads),
+            None if max_reload_amount is None else _to_cents(max_reload_amount),
+        ]
+    except (TypeError, ValueError) as e:
+        return {"status": "error", "message": str(e)}
+    limit = page_size(limit, PAGE_SIZE, MAX_PAGE_SIZE)
+
+    # Read from one snapshot so the actions scanned and last_id agree; the
+    # writer is only taken to save the new state.
+    with db.reader() as c:
+        c.execute("BEGIN")
+        saved = None
+        if resume:
+            saved = c.execute(
+                "SELECT last_id, cards, state FROM card_scan_state WHERE window_days = ?", (window_days,)
+            ).fetchone()
+        if saved is None:
+            after_id, windows = 0, CardWindows(window_days)
+        else:
+            after_id, windows = saved[0], CardWindows(window_days, json.loads(saved[1]), saved[2])
+        last_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM cardactions").fetchone()[0]
+
+        scanned = skipped = 0
+        for day, group in itertools.groupby(_daily_card_totals(c, after_id, last_id), key=lambda r: r[0]):
+            # Dates written with a time of day share the day with the plain date.
+            totals = {}
+            for _, card, *values in group:
+                known = totals.get(card)
+                totals[card] = values if known is None else [a + b for a, b in zip(known, values)]
+            counts = np.array([t[0] for t in totals.values()], dtype=np.int64)
+            values = np.array([t[1:] for t in totals.values()], dtype=np.int64).T
+            in_time = windows.add_day(day, list(totals), values)
+            scanned += int(counts.sum())
+            skipped += int(counts[~in_time].sum())
+
+    with db.transaction() as c:
+        c.execute(
+            "INSERT OR REPLACE INTO card_scan_state(window_days, last_id, cards, state, updated_at) VALUES (?,?,?,?,?)",
+            (window_days, last_id, json.dumps(windows.cards), windows.state(),
+             datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"))
+        )
+
+    anomalies = []
+    n = len(windows.cards)
+    for field, (rule, threshold) in enumerate(zip(CardWindows.FIELDS, thresholds)):
+        if threshold is None:
+            continue
+        shown = money if rule in CardWindows.AMOUNTS else int
+        peaks = windows.peaks[field, :n]
+        for row in np.flatnonzero(peaks > threshold):
+            value = int(peaks[row])
+            anomalies.append((value / max(threshold, 1), {
+                "cardnumber": windows.cards[row],
+                "rule": rule,
+                "value": shown(value),
+                "threshold": shown(threshold),
+                "window_end": (EPOCH + datetime.timedelta(days=int(windows.peak_days[field, row]))).isoformat(),
+            }))
+    anomalies.sort(key=lambda a: -a[0])
+    return {
+        "status": "ok",
+        "from_id": after_id,
+        "last_id": last_id,
+        "scanned": scanned,
+        "skipped_late": skipped,
+        "cards": n,
+        "flagged": len(anomalies),
+        "anomalies": [anomaly for _, anomaly in anomalies[:limit]],
+    }
+
+@mcp.resource("foodcard://metrics", mime_type="application/json")
+def metrics():
+    # Lane and per-tool occupancy, call counts and latency, plus the tenant database pool
+    return json.dumps({**runner.stats(), "shards": shards.stats()})
 
 if __name__ == "__main__":
     mcp.run(transport="http", host="0.0.0.0", port=8001) #http transport on port 8001 by default
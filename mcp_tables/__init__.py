@@ -0,0 +1,48 @@
+'''Shared data access for the MCP servers in this repository.
+
+Pooled SQLite connections and migrations (database), bounded thread pools with
+per-tool gates and timing (lanes), tenant shards (tenancy), row encoding and
+pagination helpers (rows) and declarative tables that generate a server's
+add/list/update/delete/batch tools (table).
+'''
+
+from .database import Database, migrate
+from .lanes import CancelScope, Lane, Overloaded, ToolGate, ToolRunner, ToolTimer, cancel_scope
+from .rows import (
+    MINOR_UNITS,
+    RESPONSE_FORMATS,
+    decode_cursor,
+    encode_cursor,
+    money,
+    page_size,
+    shape_rows,
+    to_cents,
+)
+from .table import Column, Table
+from .tenancy import DEFAULT_TENANT, TENANT_ID_RE, ShardPool, Tenancy
+
+__all__ = [
+    "CancelScope",
+    "Column",
+    "DEFAULT_TENANT",
+    "Database",
+    "Lane",
+    "MINOR_UNITS",
+    "Overloaded",
+    "RESPONSE_FORMATS",
+    "ShardPool",
+    "TENANT_ID_RE",
+    "Table",
+    "Tenancy",
+    "ToolGate",
+    "ToolRunner",
+    "ToolTimer",
+    "cancel_scope",
+    "decode_cursor",
+    "encode_cursor",
+    "migrate",
+    "money",
+    "page_size",
+    "shape_rows",
+    "to_cents",
+]
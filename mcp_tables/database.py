@@ -0,0 +1,256 @@
+from contextlib import contextmanager
+import datetime
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+
+from .lanes import cancel_scope
+
+# Applied once to every connection when it is opened, never per call.
+PRAGMAS = (
+    ("busy_timeout", 5000),
+    ("synchronous", "NORMAL"),   # durable enough under WAL, one fsync per checkpoint
+    ("cache_size", -64000),      # 64 MiB page cache
+    ("mmap_size", 268435456),    # 256 MiB memory-mapped reads
+    ("temp_store", "MEMORY"),
+)
+
+# Prepared statements each connection keeps, keyed by SQL text. Statement
+# builders cache their SQL per column set, so one entry serves every call of a shape.
+STATEMENT_CACHE_SIZE = 256
+
+
+class Database:
+    '''Shared SQLite access: one writer connection plus a bounded pool of read-only connections.
+
+    The database runs in WAL mode so readers never block behind the writer. Reader
+    connections are opened lazily up to ``read_pool_size`` and reused; a connection
+    that has sat idle longer than ``health_check_interval`` is pinged before reuse
+    and replaced if it no longer answers. Connections in use by an offloaded tool
+    call are interrupted if the call is cancelled.
+
+    ``attachments``, if given, is called with a connection and returns
+    ``{schema: path}`` of the databases that should be attached to it; the
+    connection is brought in line before use, so files attached by another
+    process show up without a restart. ``attachments_version``, if given, is
+    called with a connection each time one is handed out and returns a cheap
+    token that changes whenever the attachments do; a connection is only brought
+    in line when the token differs from the one it last saw. Without it that
+    happens on every checkout. Attached databases get a page cache of
+    ``attached_cache_kib`` of their own and no memory map.
+    '''
+
+    def __init__(self, path, read_pool_size=4, timeout=5.0, health_check_interval=30.0, attachments=None, attachments_version=None, attached_cache_kib=2048):
+        self.path = path
+        self.timeout = timeout
+        self.read_pool_size = read_pool_size
+        self.health_check_interval = health_check_interval
+        self.attachments = attachments
+        self.attachments_version = attachments_version
+        # Connection -> attachments version it was last brought in line with.
+        self._attached_at = {}
+        self.attached_cache_kib = attached_cache_kib
+        self._write_lock = threading.Lock()
+        self._writer = self._connect(readonly=False)
+        self.journal_mode = self._writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(read_pool_size)
+        self._count_lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+
+    def _connect(self, readonly):
+        if readonly:
+            uri = pathlib.Path(self.path).as_uri() + "?mode=ro"
+            conn = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+            )
+        else:
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+            )
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _sync_attachments(self, conn, readonly):
+        if self.attachments is None:
+            return
+        version = None if self.attachments_version is None else self.attachments_version(conn)
+        if version is not None and self._attached_at.get(conn) == version:
+            return
+        wanted = self.attachments(conn)
+        current = {name for _, name, _ in conn.execute("PRAGMA database_list")} - {"main", "temp"}
+        for name in current - wanted.keys():
+            conn.execute(f"DETACH DATABASE {name}")
+        for name in wanted.keys() - current:
+            target = pathlib.Path(wanted[name]).as_uri() + "?mode=ro" if readonly else wanted[name]
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (target,))
+            conn.execute(f"PRAGMA {name}.cache_size=-{self.attached_cache_kib}")
+            conn.execute(f"PRAGMA {name}.mmap_size=0")
+        self._attached_at[conn] = version
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @contextmanager
+    def transaction(self):
+        '''Run a write transaction on the shared writer connection.'''
+        if not self._write_lock.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("timed out waiting for the writer connection")
+        try:
+            # ATTACH is not allowed inside a transaction.
+            self._sync_attachments(self._writer, readonly=False)
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                scope = cancel_scope.get()
+                if scope is None:
+                    yield self._writer
+                else:
+                    with scope.using(self._writer):
+                        yield self._writer
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+        finally:
+            self._write_lock.release()
+
+    @contextmanager
+    def reader(self):
+        '''Borrow a read-only connection from the pool.'''
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("timed out waiting for a reader connection")
+        conn = None
+        try:
+            conn = self._checkout()
+            self._sync_attachments(conn, readonly=True)
+            scope = cancel_scope.get()
+            if scope is None:
+                yield conn
+            else:
+                with scope.using(conn):
+                    yield conn
+        except sqlite3.Error:
+            # Don't hand a broken connection to the next caller.
+            if conn is not None and not self._ping(conn):
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._idle.put((conn, time.monotonic()))
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect(readonly=True)
+                with self._count_lock:
+                    self._opened += 1
+                return conn
+            if time.monotonic() - last_used < self.health_check_interval or self._ping(conn):
+                return conn
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._count_lock:
+            self._opened -= 1
+        self._attached_at.pop(conn, None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def vacuum(self, schema="main"):
+        '''Rebuild one database file (main or an attached schema) to reclaim free pages.'''
+        if not self._write_lock.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("timed out waiting for the writer connection")
+        try:
+            self._sync_attachments(self._writer, readonly=False)
+            self._writer.execute(f"VACUUM {schema}")
+        finally:
+            self._write_lock.release()
+
+    def health(self):
+        '''Ping the writer and one reader and report pool occupancy.'''
+        writer_ok = self._write_lock.acquire(timeout=self.timeout)
+        if writer_ok:
+            try:
+                writer_ok = self._ping(self._writer)
+            finally:
+                self._write_lock.release()
+        try:
+            with self.reader() as c:
+                reader_ok = self._ping(c)
+        except sqlite3.Error:
+            reader_ok = False
+        return {
+            "status": "ok" if writer_ok and reader_ok else "error",
+            "journal_mode": self.journal_mode,
+            "writer": "ok" if writer_ok else "error",
+            "reader": "ok" if reader_ok else "error",
+            "readers_open": self._opened,
+            "readers_idle": self._idle.qsize(),
+            "read_pool_size": self.read_pool_size,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        with self._write_lock:
+            try:
+                self._writer.execute("PRAGMA optimize")
+            finally:
+                self._writer.close()
+
+
+def migrate(database, migrations):
+    '''Apply pending migrations to ``database`` in version order; returns the resulting version.
+
+    ``migrations`` is a list of ``(version, description, steps)``. A step is SQL
+    or a callable taking the connection. Each migration runs once, in its own
+    transaction, and is recorded in schema_version.
+    '''
+    with database.transaction() as c:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version(
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        """)
+    version = 0
+    for version, description, steps in sorted(migrations, key=lambda m: m[0]):
+        # Checked inside the transaction so concurrent starts apply each migration once.
+        with database.transaction() as c:
+            if c.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                continue
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute(
+                "INSERT INTO schema_version(version, description, applied_at) VALUES (?,?,?)",
+                (version, description, datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"))
+            )
+    return version
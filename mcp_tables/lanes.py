@@ -0,0 +1,249 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import bisect
+import contextvars
+import functools
+import sqlite3
+import threading
+import time
+
+
+class Overloaded(Exception):
+    '''Raised when a lane or tool is saturated and a call is refused.'''
+
+
+class CancelScope:
+    '''Connections in use by one offloaded call, so cancelling the call interrupts its statements.'''
+
+    def __init__(self):
+        self.cancelled = False
+        self._conns = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def using(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise sqlite3.OperationalError("interrupted")
+            self._conns.add(conn)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for conn in self._conns:
+                conn.interrupt()
+
+# The scope of the offloaded call running on this thread, if any.
+cancel_scope = contextvars.ContextVar("mcp_tables_cancel_scope", default=None)
+
+
+class Lane:
+    '''A bounded thread pool for one kind of blocking database work.
+
+    ``run`` is awaited from the event loop; the call's context variables (tenant
+    shard, request headers) travel with it to the worker thread. If the awaiting
+    task is cancelled, for instance because the client went away, a call still
+    queued is dropped and a running one has its statements interrupted, which
+    rolls back any transaction it had open. Work the call handed to another
+    thread, such as a write batcher, is not interrupted.
+    '''
+
+    def __init__(self, name, workers, max_queue=256, thread_prefix="mcp"):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = self.workers + max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{thread_prefix}-{name}")
+        # Only touched from the event loop thread.
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._cancelled = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise Overloaded(f"Server busy: the {self.name} queue is full, retry shortly")
+        scope = CancelScope()
+        context = contextvars.copy_context()
+        context.run(cancel_scope.set, scope)
+        future = self._executor.submit(context.run, fn, *args, **kwargs)
+        self._pending += 1
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            self._cancelled += 1
+            if not future.cancel():
+                scope.cancel()
+            raise
+        finally:
+            self._pending -= 1
+        self._completed += 1
+        return result
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "cancelled": self._cancelled,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ToolGate:
+    '''Concurrency cap for one tool: ``limit`` calls run, ``max_waiting`` more wait, the rest are refused.'''
+
+    def __init__(self, name, limit=16, max_waiting=64):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self._semaphore = None
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded(f"Server busy: too many concurrent {self.name} calls, retry shortly")
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class ToolTimer:
+    '''Call count, error count and a latency histogram for one tool.
+
+    Latency runs from the call reaching the tool to its result, so time spent
+    waiting at the gate or in a lane's queue is included. Only touched from the
+    event loop thread.
+    '''
+
+    # Upper bounds of the latency histogram buckets, in milliseconds.
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self._histogram = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def record(self, seconds, failed=False):
+        self.calls += 1
+        self.errors += bool(failed)
+        self.total += seconds
+        self.slowest = max(self.slowest, seconds)
+        self._histogram[bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)] += 1
+
+    def _percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls.
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(self.BUCKETS_MS + (None,), self._histogram):
+            seen += count
+            if seen >= target:
+                return bound if bound is not None else round(self.slowest * 1000, 3)
+        return None
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_ms": round(self.total / self.calls * 1000, 3) if self.calls else None,
+            "max_ms": round(self.slowest * 1000, 3),
+            "p50_ms": self._percentile(0.5) if self.calls else None,
+            "p95_ms": self._percentile(0.95) if self.calls else None,
+            "p99_ms": self._percentile(0.99) if self.calls else None,
+        }
+
+
+class ToolRunner:
+    '''Reader and writer lanes for one server, plus a gate and a timer per tool.
+
+    Reads and writes never compete for the same workers. Each lane queues at
+    most ``max_queue`` calls beyond its busy workers and each tool runs at most
+    ``max_concurrency`` calls at once with ``max_waiting`` more waiting; past
+    either limit a call is refused immediately instead of piling up.
+    '''
+
+    def __init__(self, name, reader_workers, writer_workers, max_queue=256, max_concurrency=16, max_waiting=64):
+        self.readers = Lane("reader", reader_workers, max_queue, thread_prefix=name)
+        self.writers = Lane("writer", writer_workers, max_queue, thread_prefix=name)
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.gates = {}
+        self.timers = {}
+
+    def gated(self, limit=None):
+        '''Give a coroutine tool its gate and timer without running it on a lane.
+
+        For tools whose blocking work is already handed off the event loop, such
+        as writes queued to a batcher thread, so that no lane thread sits waiting
+        for it. A refused call returns an error result instead of raising.
+        '''
+        def decorate(fn):
+            gate = self.gates[fn.__name__] = ToolGate(fn.__name__, limit or self.max_concurrency, self.max_waiting)
+            timer = self.timers[fn.__name__] = ToolTimer()
+
+            @functools.wraps(fn)
+            async def tool(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    async with gate:
+                        result = await fn(*args, **kwargs)
+                except Overloaded as e:
+                    return {"status": "error", "message": str(e)}
+                except Exception:
+                    timer.record(time.perf_counter() - started, failed=True)
+                    raise
+                failed = isinstance(result, dict) and result.get("status") == "error"
+                timer.record(time.perf_counter() - started, failed)
+                return result
+            return tool
+        return decorate
+
+    def offload(self, lane, limit=None):
+        '''Turn a blocking tool function into an async one that runs on ``lane``.
+
+        The signature and docstring are kept, so the tool's schema is unchanged.
+        A refused call returns an error result instead of raising.
+        '''
+        def decorate(fn):
+            @functools.wraps(fn)
+            async def run(*args, **kwargs):
+                return await lane.run(fn, *args, **kwargs)
+            return self.gated(limit)(run)
+        return decorate
+
+    def stats(self):
+        return {
+            "lanes": {lane.name: lane.stats() for lane in (self.readers, self.writers)},
+            "tools": {name: {**gate.stats(), **self.timers[name].stats()} for name, gate in self.gates.items()},
+        }
+
+    def close(self):
+        self.readers.close()
+        self.writers.close()
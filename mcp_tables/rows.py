@@ -0,0 +1,77 @@
+import base64
+import decimal
+import gzip
+import json
+
+# Amounts are stored as integers in minor units: 100 per currency unit.
+MINOR_UNITS = 100
+
+# "records" is a list of dicts; "table" sends column names once plus row arrays;
+# "columnar" sends column names once plus one array per column.
+RESPONSE_FORMATS = ("records", "table", "columnar")
+
+
+def to_cents(value, minor_units=MINOR_UNITS):
+    '''Convert an amount in currency units (12.5, "12.50") to integer minor units; raises ValueError.
+
+    Parsed as a decimal from its text so 0.1 + 0.2 style binary noise never
+    reaches storage; fractions of a minor unit round half away from zero.
+    '''
+    if isinstance(value, bool):
+        raise ValueError(f"invalid amount {value!r}")
+    try:
+        amount = decimal.Decimal(str(value).strip())
+    except (decimal.InvalidOperation, TypeError):
+        raise ValueError(f"invalid amount {value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"invalid amount {value!r}")
+    cents = int((amount * minor_units).to_integral_value(rounding=decimal.ROUND_HALF_UP))
+    if abs(cents) >= 2 ** 63:
+        raise ValueError(f"amount {value!r} is out of range")
+    return cents
+
+def money(cents, minor_units=MINOR_UNITS):
+    '''Integer minor units back to a currency amount for responses.'''
+    return round(float(cents) / minor_units, 2)
+
+def encode_cursor(*key):
+    '''Opaque page token for a keyset position such as ``(date, id)``.'''
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token, types):
+    '''Read back an encode_cursor() token whose key parts have ``types``; raises ValueError.'''
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+        if (
+            isinstance(key, list) and len(key) == len(types)
+            and all(isinstance(part, kind) and not isinstance(part, bool) for part, kind in zip(key, types))
+        ):
+            return tuple(key)
+    except (ValueError, TypeError):
+        pass
+    raise ValueError("Invalid cursor")
+
+def shape_rows(cols, rows, format="records", compress=False):
+    '''Render fetched row tuples in one of RESPONSE_FORMATS, optionally gzip-compressed.'''
+    if format == "table":
+        payload = {"columns": cols, "rows": rows, "count": len(rows)}
+    elif format == "columnar":
+        values = [list(col) for col in zip(*rows)] if rows else [[] for _ in cols]
+        payload = {"columns": cols, "values": values, "count": len(rows)}
+    else:
+        payload = [dict(zip(cols, r)) for r in rows]
+    if compress:
+        raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        payload = {
+            "encoding": "gzip+base64",
+            "format": format,
+            "count": len(rows),
+            "data": base64.b64encode(gzip.compress(raw, compresslevel=6, mtime=0)).decode("ascii"),
+        }
+    return payload
+
+def page_size(limit, default, maximum):
+    '''Clamp a requested page size to 1..maximum, using ``default`` when none was asked for.'''
+    return min(max(1, limit or default), maximum)
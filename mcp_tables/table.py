@@ -0,0 +1,482 @@
+import functools
+import inspect
+import json
+
+from .rows import RESPONSE_FORMATS, decode_cursor, encode_cursor, page_size, shape_rows
+
+_MISSING = inspect.Parameter.empty
+
+
+class Column:
+    '''One field of a table, as its tools take and return it.
+
+    ``store`` names the stored column when it differs from ``name``; ``parse``
+    turns a tool argument into the stored value (raising ValueError) and
+    ``select`` is the SQL expression turning it back. A column with ``match``
+    set to "exact" or "nocase" becomes a filter of the list and batch tools,
+    described by ``match_doc`` ("actions on this card"); ``match_values``, if
+    given, turns a filter value into every stored value it should match (the
+    spellings of one name, say). ``range_store`` and ``range_parse`` name the
+    column, and the conversion from a tool argument, that a date range on this
+    column is compared against when that is not the stored column itself.
+    '''
+
+    def __init__(self, name, doc, type=str, required=False, default=None, store=None, parse=None, select=None,
+                 match=None, update_doc=None, match_doc=None, match_values=None, range_store=None, range_parse=None):
+        if match not in (None, "exact", "nocase"):
+            raise ValueError(f"match must be 'exact' or 'nocase', not {match!r}")
+        self.name = name
+        self.doc = doc
+        self.type = type
+        self.required = required
+        self.default = default
+        self.store = store or name
+        self.parse = parse
+        self.select = select
+        self.match = match
+        self.match_values = match_values
+        self.range_store = range_store or self.store
+        self.range_parse = range_parse
+        self.update_doc = update_doc or doc
+        self.match_doc = match_doc or f"rows with this {name}"
+
+    @property
+    def select_sql(self):
+        if self.select is not None:
+            return f"{self.select} AS {self.name}"
+        return self.store if self.store == self.name else f"{self.store} AS {self.name}"
+
+    def condition(self, value, params):
+        '''SQL matching filter ``value``; appends its parameters to ``params``, raises ValueError.'''
+        if self.match_values is not None:
+            values = self.match_values(value)
+            params.extend(values)
+            return f"{self.store} IN ({', '.join('?' * len(values))})"
+        params.append(self.parse(value) if self.parse is not None else value)
+        return f"{self.store} = ?" + (" COLLATE NOCASE" if self.match == "nocase" else "")
+
+
+def _signature(params):
+    return [
+        inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=default, annotation=annotation)
+        for name, annotation, default in params
+    ]
+
+def _tool(name, doc, params, body):
+    '''A function called ``name`` with keyword-only ``params`` ``(name, annotation, default)`` that calls ``body``.
+
+    FastMCP builds the tool's schema from the signature and the Args section of
+    ``doc``, exactly as for a hand-written function.
+    '''
+    signature = inspect.Signature(_signature(params))
+
+    def tool(**arguments):
+        bound = signature.bind(**arguments)
+        bound.apply_defaults()
+        return body(**bound.arguments)
+
+    tool.__name__ = tool.__qualname__ = name
+    tool.__doc__ = doc
+    tool.__signature__ = signature
+    tool.__annotations__ = {p.name: p.annotation for p in signature.parameters.values() if p.annotation is not _MISSING}
+    return tool
+
+def _arg(name, type, doc, optional=True):
+    kind = getattr(type, "__name__", str(type))
+    return f"        {name} ({kind}{', optional' if optional else ''}): {doc}"
+
+
+class Table:
+    '''A table with an integer key and a date column, and the tools that edit it.
+
+    Statements are built once per table, schema and column set and cached, so
+    sqlite3 keeps reusing the prepared statement behind each; list pages are
+    keyset pages ordered by ``(range_column, key)`` so every page costs the
+    same, and batch edits run one prepared statement over every selected row.
+    register() turns the declaration into add, list, update and delete tools
+    plus their batch forms, so a new domain server only declares its columns.
+    '''
+
+    def __init__(self, name, noun, columns, plural=None, key="id", range_column="date",
+                 page_size=50, max_page_size=1000, batch_max_rows=50000, unpaged_max_rows=10000):
+        self.name = name
+        self.noun = noun
+        self.plural = plural or f"{noun}s"
+        self.columns = tuple(columns)
+        self.fields = {col.name: col for col in self.columns}
+        self.key = key
+        self.range = self.fields[range_column]
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.batch_max_rows = batch_max_rows
+        self.unpaged_max_rows = unpaged_max_rows
+        self.output = [key, *(col.name for col in self.columns)]
+        self.select_list = ", ".join([key, *(col.select_sql for col in self.columns)])
+        self.cursor_types = (self.range.type, int)
+        self._range_at = self.output.index(self.range.name)
+
+    # Statements, built once per shape.
+
+    @functools.lru_cache(maxsize=64)
+    def insert_sql(self, columns, schema="main"):
+        '''INSERT of the stored ``columns``.'''
+        return f"INSERT INTO {schema}.{self.name}({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    @functools.lru_cache(maxsize=256)
+    def update_sql(self, columns, schema="main"):
+        '''UPDATE by key setting the stored ``columns``.'''
+        return f"UPDATE {schema}.{self.name} SET {', '.join(f'{col} = ?' for col in columns)} WHERE {self.key} = ?"
+
+    @functools.lru_cache(maxsize=16)
+    def delete_sql(self, schema="main"):
+        '''DELETE by key.'''
+        return f"DELETE FROM {schema}.{self.name} WHERE {self.key} = ?"
+
+    # Validation and row selection.
+
+    def parse(self, fields, partial=False):
+        '''Validate tool arguments; returns ``{stored column: value}`` in declaration order, raises ValueError.
+
+        With ``partial`` only the fields given (not None) are returned, as an update sets them.
+        '''
+        unknown = sorted(set(fields) - self.fields.keys())
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        values = {}
+        for col in self.columns:
+            value = fields.get(col.name)
+            if value is None:
+                if partial:
+                    continue
+                if col.required:
+                    raise ValueError(f"{col.name} is required")
+                value = col.default
+            values[col.store] = col.parse(value) if col.parse is not None and value is not None else value
+        return values
+
+    def filter_sql(self, where, params, filters):
+        '''Narrow ``where``/``params`` by the matchable columns given in ``filters``; raises ValueError.'''
+        for col in self.columns:
+            value = filters.get(col.name) if col.match else None
+            if value is not None:
+                where += f" AND {col.condition(value, params)}"
+        return where, params
+
+    def range_sql(self, start_date, end_date):
+        '''WHERE clause and params selecting an inclusive range of the range column; raises ValueError.'''
+        parse = self.range.range_parse
+        bounds = [start_date, end_date] if parse is None else [parse(start_date), parse(end_date)]
+        return f"{self.range.range_store} BETWEEN ? AND ?", bounds
+
+    def selection_sql(self, ids, start_date, end_date, filters):
+        '''Turn a batch edit's row selection into a WHERE clause and its params; raises ValueError.'''
+        if ids is not None:
+            if start_date is not None or end_date is not None:
+                raise ValueError("Pass either ids or start_date and end_date, not both")
+            if not ids:
+                raise ValueError("ids must not be empty")
+            if any(isinstance(i, bool) or not isinstance(i, int) for i in ids):
+                raise ValueError("ids must be integers")
+            where, params = f"{self.key} IN (SELECT value FROM json_each(?))", [json.dumps(sorted(set(ids)))]
+        elif start_date is not None and end_date is not None:
+            where, params = self.range_sql(start_date, end_date)
+        else:
+            raise ValueError(f"Pass ids, or start_date and end_date, to select the {self.plural}")
+        return self.filter_sql(where, params, filters)
+
+    # Tool bodies, usable from hand-written tools as well.
+
+    def add_row(self, db, fields):
+        try:
+            values = self.parse(fields)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        with db.transaction() as c:
+            cur = c.execute(self.insert_sql(tuple(values)), list(values.values()))
+        return {"status": "ok", "id": cur.lastrowid}
+
+    def list_rows(self, db, start_date, end_date, filters, limit=None, cursor=None, format="records", compress=False):
+        '''Every matching row ordered by key, or with ``limit``/``cursor`` one keyset page and its next_cursor.'''
+        if format not in RESPONSE_FORMATS:
+            return {"status": "error", "message": f"format must be one of: {', '.join(RESPONSE_FORMATS)}"}
+        try:
+            after = decode_cursor(cursor, self.cursor_types) if cursor else None
+            where, params = self.filter_sql(*self.range_sql(start_date, end_date), filters)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        select = f"SELECT {self.select_list} FROM {self.name}"
+
+        if limit is None and cursor is None:
+            with db.reader() as c:
+                rows = c.execute(
+                    f"{select} WHERE {where} ORDER BY {self.key} ASC LIMIT ?", [*params, self.unpaged_max_rows + 1]
+                ).fetchall()
+            if len(rows) > self.unpaged_max_rows:
+                return {"status": "error", "message": f"More than {self.unpaged_max_rows} {self.plural} match; pass limit or cursor to page through them"}
+            return shape_rows(self.output, rows, format, compress)
+
+        limit = page_size(limit, self.page_size, self.max_page_size)
+        if after is not None:
+            where += f" AND ({self.range.store}, {self.key}) > (?, ?)"
+            params.extend(after)
+        with db.reader() as c:
+            rows = c.execute(
+                f"{select} WHERE {where} ORDER BY {self.range.store}, {self.key} LIMIT ?", [*params, limit + 1]
+            ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(rows[limit - 1][self._range_at], rows[limit - 1][0])
+        return {"items": shape_rows(self.output, rows[:limit], format, compress), "next_cursor": next_cursor}
+
+    def update_row(self, db, id, fields):
+        try:
+            changes = self.parse(fields, partial=True)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        if not changes:
+            return {"status": "error", "message": "No fields provided for update"}
+        with db.transaction() as c:
+            cur = c.execute(self.update_sql(tuple(changes)), [*changes.values(), id])
+        if cur.rowcount == 0:
+            return {"status": "error", "message": f"Record with id {id} not found"}
+        return {"status": "ok", "updated_id": id}
+
+    def delete_row(self, db, id):
+        with db.transaction() as c:
+            cur = c.execute(self.delete_sql(), (id,))
+        if cur.rowcount == 0:
+            return {"status": "error", "message": f"Record with id {id} not found"}
+        return {"status": "ok", "deleted_id": id}
+
+    def batch_edit(self, db, ids, start_date, end_date, filters, dry_run, statement, params):
+        '''Run ``statement`` once per selected key (with ``params`` before it) in one transaction.'''
+        try:
+            where, selection = self.selection_sql(ids, start_date, end_date, filters)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        with (db.reader() if dry_run else db.transaction()) as c:
+            selected = [
+                id for id, in c.execute(
+                    f"SELECT {self.key} FROM {self.name} WHERE {where} LIMIT ?", [*selection, self.batch_max_rows + 1]
+                )
+            ]
+            if len(selected) > self.batch_max_rows:
+                return {"status": "error", "message": f"More than {self.batch_max_rows} {self.plural} selected; narrow the selection"}
+            result = {"status": "ok", "matched": len(selected)}
+            if ids is not None:
+                missing = sorted(set(ids) - set(selected))
+                if missing:
+                    result["status"] = "partial"
+                    result["unmatched_ids"] = missing
+            if dry_run:
+                result["dry_run"] = True
+            else:
+                result["changed"] = c.executemany(statement, ([*params, id] for id in selected)).rowcount
+        return result
+
+    def update_rows(self, db, changes, ids, start_date, end_date, filters, dry_run):
+        if not isinstance(changes, dict):
+            return {"status": "error", "message": "changes must be an object"}
+        unknown = sorted(set(changes) - self.fields.keys())
+        if unknown:
+            return {"status": "error", "message": f"Unknown fields in changes: {', '.join(unknown)}"}
+        try:
+            values = self.parse(changes, partial=True)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        if not values:
+            return {"status": "error", "message": "No fields provided for update"}
+        return self.batch_edit(
+            db, ids, start_date, end_date, filters, dry_run, self.update_sql(tuple(values)), list(values.values())
+        )
+
+    def delete_rows(self, db, ids, start_date, end_date, filters, dry_run):
+        return self.batch_edit(db, ids, start_date, end_date, filters, dry_run, self.delete_sql(), [])
+
+    # Tool generation.
+
+    def register(self, mcp, runner, db, names, batch_limit=4):
+        '''Add this table's tools to ``mcp``; returns them by name.
+
+        ``names`` maps the tools to generate ("add", "list", "update", "delete",
+        "update_many", "delete_many") to their tool names. Writes run on the
+        runner's writer lane, lists on its reader lane, and each batch tool runs
+        at most ``batch_limit`` calls at once. ``db`` is the Database, or a proxy
+        for the current tenant's.
+        '''
+        builders = {
+            "add": (self._add_tool, runner.writers, None),
+            "list": (self._list_tool, runner.readers, None),
+            "update": (self._update_tool, runner.writers, None),
+            "delete": (self._delete_tool, runner.writers, None),
+            "update_many": (self._update_many_tool, runner.writers, batch_limit),
+            "delete_many": (self._delete_many_tool, runner.writers, batch_limit),
+        }
+        unknown = sorted(set(names) - builders.keys())
+        if unknown:
+            raise ValueError(f"Unknown tools: {', '.join(unknown)}")
+        tools = {}
+        for kind, name in names.items():
+            build, lane, limit = builders[kind]
+            tools[name] = mcp.tool()(runner.offload(lane, limit)(build(name, db)))
+        return tools
+
+    def _matches(self):
+        return [col for col in self.columns if col.match]
+
+    def _add_tool(self, name, db):
+        params = [
+            (col.name, col.type, _MISSING if col.required else col.default)
+            for col in self.columns
+        ]
+        doc = "\n".join([
+            f"Add a new {self.noun} to the database.",
+            "",
+            "    Args:",
+            *(_arg(col.name, col.type, col.doc, not col.required) for col in self.columns),
+            "",
+            "    Returns:",
+            f"        dict: The new {self.noun}'s id, or an error message.",
+            "    ",
+        ])
+        return _tool(name, doc, params, lambda **fields: self.add_row(db, fields))
+
+    def _list_tool(self, name, db):
+        matches = self._matches()
+        params = [
+            ("start_date", str, _MISSING),
+            ("end_date", str, _MISSING),
+            *((col.name, col.type, None) for col in matches),
+            ("limit", int, None),
+            ("cursor", str, None),
+            ("format", str, "records"),
+            ("compress", bool, False),
+        ]
+        doc = "\n".join([
+            f"List {self.plural} within an inclusive date range.",
+            "",
+            f"    Without limit or cursor every matching {self.noun} is returned at once, ordered",
+            f"    by id, up to {self.unpaged_max_rows}; larger ranges must be paged. Passing either",
+            f"    switches to pages ordered by {self.range.name} then id.",
+            "",
+            "    Args:",
+            _arg("start_date", str, "The start date of the range in YYYY-MM-DD format.", False),
+            _arg("end_date", str, "The end date of the range in YYYY-MM-DD format.", False),
+            *(
+                _arg(col.name, col.type, f"Only {col.match_doc}{' (case-insensitive)' if col.match == 'nocase' else ''}.")
+                for col in matches
+            ),
+            _arg("limit", int, f"Page size (max {self.max_page_size}). Defaults to {self.page_size} when paging."),
+            _arg("cursor", str, "The next_cursor value of the previous page."),
+            _arg("format", str, f'"records" (a dict per {self.noun}), "table" ({{columns, rows}}) or'),
+            '            "columnar" ({columns, values} with one array per column). Defaults to "records".',
+            _arg("compress", bool, "Return the result gzip-compressed and base64-encoded"),
+            "            as {encoding, format, count, data}. Defaults to False.",
+            "",
+            "    Returns:",
+            f"        list: A list of dictionaries, each representing a {self.noun} (or the table/columnar",
+            '        object), or when paging a dict with "items" and "next_cursor" (None on the last page).',
+            "    ",
+        ])
+
+        def body(start_date, end_date, limit, cursor, format, compress, **filters):
+            return self.list_rows(db, start_date, end_date, filters, limit, cursor, format, compress)
+        return _tool(name, doc, params, body)
+
+    def _update_tool(self, name, db):
+        params = [(self.key, int, _MISSING), *((col.name, col.type, None) for col in self.columns)]
+        doc = "\n".join([
+            f"Update an existing {self.noun} by its ID.",
+            "",
+            "    Args:",
+            _arg(self.key, int, "The ID of the record to update.", False),
+            *(_arg(col.name, col.type, col.update_doc) for col in self.columns),
+            "",
+            "    Returns:",
+            "        dict: A status message indicating success or failure.",
+            "    ",
+        ])
+
+        def body(**fields):
+            return self.update_row(db, fields.pop(self.key), fields)
+        return _tool(name, doc, params, body)
+
+    def _delete_tool(self, name, db):
+        doc = "\n".join([
+            f"Delete a {self.noun} from the database by its ID.",
+            "",
+            "    Args:",
+            _arg(self.key, int, "The ID of the record to delete.", False),
+            "",
+            "    Returns:",
+            "        dict: A status message indicating success or failure.",
+            "    ",
+        ])
+        return _tool(name, doc, [(self.key, int, _MISSING)], lambda **key: self.delete_row(db, key[self.key]))
+
+    def _selection_params(self):
+        return [
+            ("ids", list[int], None),
+            ("start_date", str, None),
+            ("end_date", str, None),
+            *((col.name, col.type, None) for col in self._matches()),
+            ("dry_run", bool, False),
+        ]
+
+    def _selection_args(self, verb):
+        return [
+            _arg("ids", list, f"IDs of the records to {verb}."),
+            _arg("start_date", str, "Start of the date range in YYYY-MM-DD format."),
+            _arg("end_date", str, "End of the date range in YYYY-MM-DD format."),
+            *(_arg(col.name, col.type, f"Only {verb} {col.match_doc}.") for col in self._matches()),
+        ]
+
+    def _selection_intro(self):
+        narrowed = " and/or ".join(col.name for col in self._matches())
+        if not narrowed:
+            return [f"    Select the {self.plural} either by ids or by an inclusive date range."]
+        return [
+            f"    Select the {self.plural} either by ids or by an inclusive date range;",
+            f"    both can be narrowed by {narrowed}.",
+        ]
+
+    def _update_many_tool(self, name, db):
+        fields = ", ".join(col.name for col in self.columns)
+        doc = "\n".join([
+            f"Apply the same changes to many {self.plural} in one transaction.",
+            "",
+            *self._selection_intro(),
+            "    Either all of them are updated or none are.",
+            "",
+            "    Args:",
+            _arg("changes", dict, f"Fields to set, any of: {fields}.", False),
+            *self._selection_args("update"),
+            _arg("dry_run", bool, "Only count the records that would change. Defaults to False."),
+            "",
+            "    Returns:",
+            "        dict: The number of records matched and changed, plus any requested ids that matched nothing.",
+            "    ",
+        ])
+
+        def body(changes, ids, start_date, end_date, dry_run, **filters):
+            return self.update_rows(db, changes, ids, start_date, end_date, filters, dry_run)
+        return _tool(name, doc, [("changes", dict, _MISSING), *self._selection_params()], body)
+
+    def _delete_many_tool(self, name, db):
+        doc = "\n".join([
+            f"Delete many {self.plural} in one transaction.",
+            "",
+            *self._selection_intro(),
+            "",
+            "    Args:",
+            *self._selection_args("delete"),
+            _arg("dry_run", bool, "Only count the records that would be deleted. Defaults to False."),
+            "",
+            "    Returns:",
+            "        dict: The number of records matched and deleted, plus any requested ids that matched nothing.",
+            "    ",
+        ])
+
+        def body(ids, start_date, end_date, dry_run, **filters):
+            return self.delete_rows(db, ids, start_date, end_date, filters, dry_run)
+        return _tool(name, doc, self._selection_params(), body)
@@ -0,0 +1,260 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+import re
+import threading
+import time
+
+from fastmcp.exceptions import ResourceError, ToolError
+from fastmcp.server.dependencies import get_http_headers
+from fastmcp.server.middleware import Middleware
+
+DEFAULT_TENANT = "default"
+TENANT_ID_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+class _Entry:
+    def __init__(self, shard):
+        self.shard = shard
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+
+class ShardPool:
+    '''Tenant shards, opened on first use and kept in least-recently-used order.
+
+    ``open_shard(tenant)`` opens a tenant's shard, anything with a ``close()``.
+    The ``default`` shard stays open for the life of the process. Other tenants'
+    shards count against ``max_open``: opening one more closes the least recently
+    used idle shard, and a janitor thread closes shards idle for longer than
+    ``idle_timeout``. A shard leased by an in-flight call is never closed, so the
+    pool can briefly exceed its cap under load. ``lease_async()`` opens and closes
+    shards in worker threads, so a cold tenant does not stall the event loop.
+    '''
+
+    def __init__(self, default, open_shard, max_open=32, idle_timeout=300.0, default_tenant=DEFAULT_TENANT, name="mcp"):
+        self.default = default
+        self.open_shard = open_shard
+        self.default_tenant = default_tenant
+        self.max_open = max(1, max_open)
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()
+        self._opening = {}
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._evicted = 0
+        self._stopped = threading.Event()
+        self._janitor = threading.Thread(target=self._run, name=f"{name}-shard-janitor", daemon=True)
+        self._janitor.start()
+
+    @contextmanager
+    def lease(self, tenant):
+        '''Hold ``tenant``'s shard open for the duration of the block, opening it if needed.
+
+        Opening a shard blocks; from a coroutine use ``lease_async()`` instead.
+        '''
+        if tenant == self.default_tenant:
+            yield self.default
+            return
+        entry, victims = self._acquire(tenant)
+        _close_all(victims)
+        try:
+            yield entry.shard
+        finally:
+            self._release(entry)
+
+    @asynccontextmanager
+    async def lease_async(self, tenant):
+        '''``lease()`` for coroutines: shards are opened and evicted shards closed in worker threads.'''
+        if tenant == self.default_tenant:
+            yield self.default
+            return
+        with self._lock:
+            entry = self._checkout(tenant)
+            victims = []
+        if entry is None:
+            entry, victims = await asyncio.to_thread(self._acquire, tenant)
+        if victims:
+            await asyncio.to_thread(_close_all, victims)
+        try:
+            yield entry.shard
+        finally:
+            self._release(entry)
+
+    def _checkout(self, tenant):
+        # Caller holds the lock. Leases tenant's open entry, or returns None.
+        entry = self._entries.get(tenant)
+        if entry is not None:
+            self._entries.move_to_end(tenant)
+            entry.leases += 1
+        return entry
+
+    def _acquire(self, tenant):
+        # Leases tenant's entry, opening its shard if needed, and returns it with
+        # the idle shards evicted to make room. The shard is opened outside the
+        # lock so other tenants are not held up; concurrent first calls for the
+        # same tenant wait for one opener and share its shard.
+        while True:
+            with self._lock:
+                entry = self._checkout(tenant)
+                if entry is not None:
+                    return entry, []
+                opening = self._opening.get(tenant)
+                opener = opening is None
+                if opener:
+                    opening = self._opening[tenant] = Future()
+            if not opener:
+                opening.result()
+                continue
+            try:
+                shard = self.open_shard(tenant)
+            except BaseException as e:
+                with self._lock:
+                    del self._opening[tenant]
+                opening.set_exception(e)
+                raise
+            with self._lock:
+                del self._opening[tenant]
+                entry = self._entries[tenant] = _Entry(shard)
+                entry.leases = 1
+                self._opened += 1
+                victims = self._take_victims(lambda e: len(self._entries) > self.max_open)
+            opening.set_result(None)
+            return entry, victims
+
+    def _release(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+
+    def _take_victims(self, should_evict):
+        # Caller holds the lock. Walks from least to most recently used.
+        victims = []
+        for tenant, entry in list(self._entries.items()):
+            if not should_evict(entry):
+                break
+            if entry.leases == 0:
+                del self._entries[tenant]
+                victims.append(entry.shard)
+        self._evicted += len(victims)
+        return victims
+
+    def _run(self):
+        while not self._stopped.wait(max(1.0, self.idle_timeout / 4)):
+            cutoff = time.monotonic() - self.idle_timeout
+            with self._lock:
+                victims = self._take_victims(lambda e: e.last_used < cutoff)
+            _close_all(victims)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": len(self._entries),
+                "leased": sum(1 for e in self._entries.values() if e.leases),
+                "max_open": self.max_open,
+                "opened": self._opened,
+                "evicted": self._evicted,
+            }
+
+    def close(self):
+        self._stopped.set()
+        with self._lock:
+            victims = [entry.shard for entry in self._entries.values()]
+            self._entries.clear()
+        _close_all(victims + [self.default])
+
+
+def _close_all(shards):
+    for shard in shards:
+        shard.close()
+
+
+class _ShardAttribute:
+    '''Forward attribute access to the current shard, or to one of its components.'''
+
+    def __init__(self, tenancy, name):
+        self._tenancy = tenancy
+        self._name = name
+
+    def __getattr__(self, attr):
+        shard = self._tenancy.current()
+        if self._name is not None:
+            shard = getattr(shard, self._name)
+        return getattr(shard, attr)
+
+
+class Tenancy:
+    '''Routes each call to the shard of the tenant named by a request header.
+
+    Requests without the header use the pool's default shard. Tools and helpers
+    reach the current shard through attribute() proxies, so storage code reads
+    as if there were a single database; outside a request (CLI, scripts) it is
+    the default tenant's shard unless use() says otherwise.
+    '''
+
+    def __init__(self, pool, header="x-tenant-id", pattern=TENANT_ID_RE, name="mcp"):
+        self.pool = pool
+        self.header = header.lower()
+        self.pattern = pattern
+        self._current = contextvars.ContextVar(f"{name}_shard", default=None)
+
+    def current(self):
+        return self._current.get() or self.pool.default
+
+    def request_tenant(self):
+        '''Tenant named by the request's tenant header, or the default tenant; raises ValueError.'''
+        tenant = get_http_headers().get(self.header, "").strip() or self.pool.default_tenant
+        if not self.pattern.fullmatch(tenant):
+            raise ValueError(f"Invalid tenant id in {self.header} header")
+        return tenant
+
+    @contextmanager
+    def use(self, tenant):
+        '''Run the block against ``tenant``'s shard.'''
+        with self.pool.lease(tenant) as shard:
+            token = self._current.set(shard)
+            try:
+                yield shard
+            finally:
+                self._current.reset(token)
+
+    @asynccontextmanager
+    async def use_async(self, tenant):
+        '''``use()`` for coroutines, opening the shard off the event loop.'''
+        async with self.pool.lease_async(tenant) as shard:
+            token = self._current.set(shard)
+            try:
+                yield shard
+            finally:
+                self._current.reset(token)
+
+    def attribute(self, name=None):
+        '''Proxy for the current shard (``name=None``) or its ``name`` attribute.'''
+        return _ShardAttribute(self, name)
+
+    def middleware(self):
+        '''Middleware routing every tool call and resource read to the caller's shard.'''
+        return _TenantMiddleware(self)
+
+
+class _TenantMiddleware(Middleware):
+    def __init__(self, tenancy):
+        self.tenancy = tenancy
+
+    async def on_call_tool(self, context, call_next):
+        try:
+            tenant = self.tenancy.request_tenant()
+        except ValueError as e:
+            raise ToolError(str(e)) from None
+        async with self.tenancy.use_async(tenant):
+            return await call_next(context)
+
+    async def on_read_resource(self, context, call_next):
+        try:
+            tenant = self.tenancy.request_tenant()
+        except ValueError as e:
+            raise ResourceError(str(e)) from None
+        async with self.tenancy.use_async(tenant):
+            return await call_next(context)